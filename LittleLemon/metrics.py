@@ -0,0 +1,261 @@
+"""
+Per-request query and latency instrumentation.
+
+MetricsMiddleware records, for every resolved URL route, the total latency,
+number of SQL queries, time spent in the database, time spent turning model
+instances into primitives (serializer.data, wherever the view calls it) and
+time spent rendering the response body. The aggregated histograms are exposed in the
+Prometheus text format by MetricsView, and requests slower than
+METRICS_SLOW_REQUEST_SECONDS are logged together with the SQL they ran.
+
+Everything is disabled (the middleware removes itself) unless
+METRICS_ENABLED is set. Histograms are kept per process.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+from rest_framework.views import APIView
+
+logger = logging.getLogger('LittleLemon.metrics')
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SLOW_REQUEST_STATEMENTS = 20
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS = {
+    'littlelemon_request_seconds': ('Total request latency', SECONDS_BUCKETS),
+    'littlelemon_db_seconds': ('Time spent executing SQL per request', SECONDS_BUCKETS),
+    'littlelemon_db_queries': ('SQL queries per request', QUERY_BUCKETS),
+    'littlelemon_serialize_seconds': ('Time spent in serializer.data per request', SECONDS_BUCKETS),
+    'littlelemon_render_seconds': ('Time spent rendering the response body after the view returns', SECONDS_BUCKETS),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, name, route, method, value):
+        key = (name, route, method)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(METRICS[name][1])
+            histogram.observe(value)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def render(self):
+        lines = []
+        with self.lock:
+            items = sorted(self.histograms.items())
+            for name, (help, buckets) in METRICS.items():
+                lines.append('# HELP %s %s' % (name, help))
+                lines.append('# TYPE %s histogram' % name)
+                for (metric, route, method), histogram in items:
+                    if metric != name:
+                        continue
+                    labels = 'route="%s",method="%s"' % (route.replace('"', '\\"'), method)
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+                    lines.append('%s_sum{%s} %s' % (name, labels, histogram.sum))
+                    lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            self.statements.append((elapsed, sql))
+
+
+class SerializeTimer:
+    def __init__(self):
+        self.duration = None
+        self.running = False
+
+
+# The timer of the request being handled. It holds a mutable object, so time
+# added on a sync_to_async thread is still seen by the middleware.
+serialize_timer = ContextVar('serialize_timer', default=None)
+
+
+def instrument_serializers():
+    # BaseSerializer.data is what both Serializer.data and ListSerializer.data
+    # defer to; nested serializers go through to_representation instead, so
+    # each top-level serializer is timed exactly once.
+    data = BaseSerializer.data.fget
+    if getattr(data, 'instrumented', False):
+        return
+
+    def timed_data(self):
+        timer = serialize_timer.get()
+        if timer is None or timer.running:
+            return data(self)
+        timer.running = True
+        start = time.perf_counter()
+        try:
+            return data(self)
+        finally:
+            timer.running = False
+            timer.duration = (timer.duration or 0.0) + time.perf_counter() - start
+
+    timed_data.instrumented = True
+    BaseSerializer.data = property(timed_data)
+
+
+class MetricsMiddleware:
+    # Works in both modes so it never forces async views back onto a thread.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.slow_request_seconds = settings.METRICS_SLOW_REQUEST_SECONDS
+        instrument_serializers()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        timer = SerializeTimer()
+        token = serialize_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                self.wrap_connections(stack, recorder)
+                response = self.get_response(request)
+        finally:
+            serialize_timer.reset(token)
+        return self.observe(request, response, recorder, timer, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        # Connections are per thread and the async ORM runs queries on the
+        # request's thread-sensitive executor, so wrap them there.
+        recorder = QueryRecorder()
+        timer = SerializeTimer()
+        token = serialize_timer.set(timer)
+        start = time.perf_counter()
+        stack = ExitStack()
+        await sync_to_async(self.wrap_connections)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            serialize_timer.reset(token)
+        return self.observe(request, response, recorder, timer, time.perf_counter() - start)
+
+    def wrap_connections(self, stack, recorder):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+    def observe(self, request, response, recorder, timer, total):
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        registry.observe('littlelemon_request_seconds', route, request.method, total)
+        registry.observe('littlelemon_db_seconds', route, request.method, recorder.duration)
+        registry.observe('littlelemon_db_queries', route, request.method, recorder.count)
+        if timer.duration is not None:
+            registry.observe('littlelemon_serialize_seconds', route, request.method, timer.duration)
+        render = getattr(request, '_metrics_render_seconds', None)
+        if render is not None:
+            registry.observe('littlelemon_render_seconds', route, request.method, render)
+
+        if self.slow_request_seconds is not None and total >= self.slow_request_seconds:
+            self.log_slow_request(request, response, route, total, recorder)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that phase.
+        start = time.perf_counter()
+
+        def rendered(response):
+            request._metrics_render_seconds = time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def log_slow_request(self, request, response, route, total, recorder):
+        slowest = sorted(recorder.statements, key=lambda statement: statement[0], reverse=True)
+        logger.warning(
+            'Slow request %s %s (%s) -> %s in %.3fs, %d queries in %.3fs\n%s',
+            request.method, request.path, route, response.status_code, total,
+            recorder.count, recorder.duration,
+            '\n'.join('  %.4fs %s' % statement for statement in slowest[:SLOW_REQUEST_STATEMENTS]),
+        )
+
+
+class PrometheusRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Error responses, e.g. {'detail': ...} for a non-staff user.
+            data = '%s\n' % data.get('detail', data)
+        return data.encode(self.charset)
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+    renderer_classes = [PrometheusRenderer]
+
+    def get(self, request, *args, **kwargs):
+        from LittleLemonAPI.cache import cache_stats
+
+        lines = [registry.render()]
+        for name, value in sorted(cache_stats().items()):
+            lines.append('# TYPE littlelemon_menu_cache_%s_total counter\n' % name)
+            lines.append('littlelemon_menu_cache_%s_total %d\n' % (name, value))
+        return Response(''.join(lines), content_type=CONTENT_TYPE)
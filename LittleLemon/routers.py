@@ -0,0 +1,110 @@
+"""
+Read-replica routing.
+
+ReplicaRoutingMiddleware marks GET, HEAD and OPTIONS requests as safe to
+read from a replica, and ReplicaRouter then spreads their ORM reads
+round-robin over the aliases in DATABASE_REPLICAS. Everything else goes to
+the default database: writes, reads inside a transaction, and every query
+of a request that isn't safe.
+
+After a successful write, the client that made it (identified by a hash of
+its Authorization header or session cookie) is pinned to the default
+database for REPLICA_STICKY_SECONDS, so it reads its own writes while the
+replicas catch up. Pins live in the default cache, which must be shared
+between workers for them to hold across processes.
+
+Streaming responses are read after the middleware returns, so they read
+from the default database. Code that stores what it reads under a version
+taken from the default database (the menu payload cache) reads inside
+primary(), so a lagging replica can't file old rows under a new version.
+"""
+
+import hashlib
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+reading_replicas = ContextVar('reading_replicas', default=False)
+
+
+@contextmanager
+def primary():
+    # Sends the reads inside the block to the default database.
+    token = reading_replicas.set(False)
+    try:
+        yield
+    finally:
+        reading_replicas.reset(token)
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.counter = itertools.count()
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or not reading_replicas.get():
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related objects come from wherever the instance did.
+            return instance._state.db
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return replicas[next(self.counter) % len(replicas)]
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+
+def pin_key(request):
+    credentials = request.headers.get('Authorization') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return 'replica:pin:%s' % hashlib.sha256(credentials.encode('utf-8')).hexdigest()
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        key = pin_key(request)
+        safe = request.method in SAFE_METHODS
+        token = reading_replicas.set(safe and not (key and cache.get(key)))
+        try:
+            response = self.get_response(request)
+        finally:
+            reading_replicas.reset(token)
+        if key and not safe and response.status_code < 400:
+            cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        key = pin_key(request)
+        safe = request.method in SAFE_METHODS
+        token = reading_replicas.set(safe and not (key and await cache.aget(key)))
+        try:
+            response = await self.get_response(request)
+        finally:
+            reading_replicas.reset(token)
+        if key and not safe and response.status_code < 400:
+            await cache.aset(key, True, settings.REPLICA_STICKY_SECONDS)
+        return response
@@ -0,0 +1,79 @@
+import heapq
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .events import CREW_ASSIGNED, publish_order
+from .models import Order
+from .reports import record_assignments
+from .roles import DELIVERY_CREW, get_group
+
+ASSIGN_BATCH_SIZE = 500
+
+# Hands unassigned open orders to active delivery crew members, oldest order
+# first, each to whoever has the fewest open orders at that moment. Loads are
+# read with one aggregate query and then tracked in memory, so a batch costs
+# one select plus one update per crew member that received orders, whatever
+# its size.
+
+
+def crew_loads():
+    # (open orders, crew id) for every active crew member, in one query.
+    crew = User.objects.filter(groups=get_group(DELIVERY_CREW), is_active=True)
+    return list(crew.annotate(load=Count('delivery_crew', filter=Q(delivery_crew__status=False)))
+                .order_by().values_list('load', 'id'))
+
+
+def unassigned_orders():
+    # status__in rather than status=False, which SQLite can't match against
+    # the (delivery_crew, status, date, id) index.
+    return Order.objects.filter(delivery_crew__isnull=True, status__in=[False]).order_by('date', 'id')
+
+
+def assign_batch(loads, batch_size):
+    # loads is a heap of (open orders, crew id) and is updated in place.
+    with transaction.atomic():
+        orders = list(unassigned_orders().select_for_update(skip_locked=True)[:batch_size])
+        if not orders:
+            return {}
+
+        assigned = {}
+        for order in orders:
+            load, crew_id = heapq.heappop(loads)
+            assigned.setdefault(crew_id, []).append(order)
+            heapq.heappush(loads, (load + 1, crew_id))
+
+        # update() skips auto_now, so updated_at is set here for the
+        # conditional GETs and cached listings that depend on it.
+        now = timezone.now()
+        counts = {}
+        for crew_id, crew_orders in assigned.items():
+            Order.objects.filter(pk__in=[order.pk for order in crew_orders]).update(delivery_crew_id=crew_id, updated_at=now)
+            for order in crew_orders:
+                order.delivery_crew_id = crew_id
+                order.updated_at = now
+                counts[order.date, crew_id] = counts.get((order.date, crew_id), 0) + 1
+                publish_order(CREW_ASSIGNED, order, previous_delivery_crew=None)
+        record_assignments(counts)
+    return {crew_id: len(crew_orders) for crew_id, crew_orders in assigned.items()}
+
+
+def assign_orders(limit=None, batch_size=ASSIGN_BATCH_SIZE):
+    # Returns how many orders each crew member was given. Each batch commits
+    # on its own, so a long run doesn't hold its locks until the end.
+    loads = crew_loads()
+    heapq.heapify(loads)
+    totals = {}
+    remaining = limit
+    while loads and (remaining is None or remaining > 0):
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        assigned = assign_batch(loads, size)
+        if not assigned:
+            break
+        for crew_id, count in assigned.items():
+            totals[crew_id] = totals.get(crew_id, 0) + count
+        if remaining is not None:
+            remaining -= sum(assigned.values())
+    return totals
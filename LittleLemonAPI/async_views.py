@@ -0,0 +1,265 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from LittleLemon.routers import reading_replicas
+
+from .authentication import aget_token_user_id, aget_user
+from .cache import catalogue_key, get_catalogue_state, menu_cache, record
+from .conditional import make_etag, page_validators
+from .events import CLOSED, can_see, get_broker
+from .filters import filter_menu_items, filter_orders
+from .models import MenuItem, Order
+from .pagination import MenuItemPagination, OrderPagination
+from .renderers import FastJSONRenderer
+from .roles import DELIVERY_CREW, MANAGER, aget_roles
+from .serializers import MenuItemListSerializer, OrderListSerializer
+from .throttling import AnonRateThrottle, UserRateThrottle
+
+# Async-native counterparts of the read paths of MenuItemsView,
+# SingleMenuItemView and OrderView. They share filtering, pagination,
+# caching and validators with the DRF views but authenticate, check roles
+# and query through Django's async ORM, so a slow client never holds a thread.
+
+renderer = FastJSONRenderer()
+jwt_authentication = JWTAuthentication()
+throttle_classes = [AnonRateThrottle, UserRateThrottle]
+building = {}
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(renderer.render(data), status=status_code, content_type=renderer.media_type)
+
+
+async def authenticate(request):
+    header = jwt_authentication.get_header(request)
+    if header:
+        raw_token = jwt_authentication.get_raw_token(header)
+        if raw_token is not None:
+            token = jwt_authentication.get_validated_token(raw_token)
+            try:
+                user_id = token[jwt_settings.USER_ID_CLAIM]
+            except KeyError:
+                raise exceptions.AuthenticationFailed('User not found')
+            if jwt_settings.USER_ID_FIELD in ('id', 'pk'):
+                user = await aget_user(user_id)
+            else:
+                user = await User.objects.filter(**{jwt_settings.USER_ID_FIELD: user_id}).afirst()
+            if user is None:
+                raise exceptions.AuthenticationFailed('User not found')
+            if not user.is_active:
+                raise exceptions.AuthenticationFailed('User is inactive')
+            return user
+
+        parts = header.split()
+        if parts[0].lower() == b'token':
+            if len(parts) != 2:
+                raise exceptions.AuthenticationFailed('Invalid token header')
+            try:
+                user_id = await aget_token_user_id(parts[1].decode())
+            except UnicodeError:
+                user_id = None
+            if user_id is None:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            user = await aget_user(user_id)
+            if user is None or not user.is_active:
+                raise exceptions.AuthenticationFailed('User inactive or deleted.')
+            return user
+
+    # Session users, as set up by AuthenticationMiddleware.
+    if not hasattr(request, 'auser'):
+        return None
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+async def check_throttles(request, view):
+    for throttle in [throttle() for throttle in throttle_classes]:
+        if not await sync_to_async(throttle.allow_request)(request, view):
+            raise exceptions.Throttled(throttle.wait())
+
+
+def async_api_view(throttle_scopes=None):
+    # Authentication, throttling and error handling for the views below, in
+    # the same order DRF applies them. throttle_scopes works as on the DRF views.
+    def decorator(view):
+        @csrf_exempt
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request.accepted_media_type = renderer.media_type
+            try:
+                request.user = await authenticate(request)
+                if request.user is None:
+                    raise exceptions.NotAuthenticated()
+                await check_throttles(request, wrapper)
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                response = render({'detail': exc.detail} if not isinstance(exc.detail, dict) else exc.detail, exc.status_code)
+                if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                    response.status_code = status.HTTP_401_UNAUTHORIZED
+                    response.headers['WWW-Authenticate'] = jwt_authentication.authenticate_header(request)
+                if isinstance(exc, exceptions.Throttled) and exc.wait is not None:
+                    response.headers['Retry-After'] = '%d' % exc.wait
+                return response
+        wrapper.throttle_scopes = throttle_scopes or {}
+        return wrapper
+    return decorator
+
+
+def conditional(request, etag, last_modified):
+    last_modified = int(last_modified) if last_modified is not None else None
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def with_validators(response, etag, last_modified):
+    if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+        response.headers['ETag'] = etag
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(int(last_modified))
+    return response
+
+
+async def cached_catalogue(request, name, build, *parts):
+    cache = menu_cache()
+    key = await sync_to_async(catalogue_key)(name, request, *parts)
+    cached = await cache.aget(key)
+    if cached is not None:
+        record(True)
+        content_type, content = cached
+        return HttpResponse(content, content_type=content_type)
+    record(False)
+
+    async def build_and_store():
+        # Runs as its own task, so this only affects the build.
+        reading_replicas.set(False)
+        response = await build()
+        if response.status_code == status.HTTP_200_OK:
+            await cache.aset(key, (response['Content-Type'], response.content), settings.MENU_CACHE_TIMEOUT)
+        return response
+
+    # Concurrent misses for the same key on this event loop wait for the
+    # first one to build it instead of all running the same queries.
+    flight = (asyncio.get_running_loop(), key)
+    task = building.get(flight)
+    if task is None:
+        task = building[flight] = asyncio.ensure_future(build_and_store())
+        task.add_done_callback(lambda task: building.pop(flight, None))
+    response = await asyncio.shield(task)
+    if response.status_code == status.HTTP_200_OK:
+        return HttpResponse(response.content, content_type=response['Content-Type'])
+    return response
+
+
+@async_api_view(throttle_scopes={'GET': 'menu', 'HEAD': 'menu'})
+async def menu_items(request):
+    version, last_modified = await sync_to_async(get_catalogue_state)(request)
+    etag = make_etag(request, 'catalogue', version, None)
+    response = conditional(request, etag, last_modified)
+    if response is None:
+        async def build():
+            paginator = MenuItemPagination()
+            queryset = filter_menu_items(MenuItem.objects.select_related('category'), request.GET)
+            page = paginator.build_page([item async for item in paginator.get_page_queryset(queryset, request)])
+            return render(paginator.get_paginated_data(MenuItemListSerializer(page, many=True).data))
+        response = await cached_catalogue(request, 'list', build)
+    return with_validators(response, etag, last_modified)
+
+
+@async_api_view(throttle_scopes={'GET': 'menu', 'HEAD': 'menu'})
+async def menu_item(request, pk):
+    version, last_modified = await sync_to_async(get_catalogue_state)(request)
+    etag = make_etag(request, 'catalogue', version, pk)
+    response = conditional(request, etag, last_modified)
+    if response is None:
+        async def build():
+            try:
+                item = await MenuItem.objects.select_related('category').aget(pk=pk)
+            except MenuItem.DoesNotExist:
+                raise exceptions.NotFound('No MenuItem matches the given query.')
+            return render(MenuItemListSerializer(item).data)
+        response = await cached_catalogue(request, 'detail', build, pk)
+    return with_validators(response, etag, last_modified)
+
+
+@async_api_view()
+async def orders(request):
+    roles = await aget_roles(request.user)
+    if MANAGER in roles:
+        queryset = Order.objects.all()
+    elif DELIVERY_CREW in roles:
+        queryset = Order.objects.filter(delivery_crew=request.user)
+    else:
+        queryset = Order.objects.filter(user=request.user)
+    queryset = filter_orders(queryset, request.GET)
+
+    paginator = OrderPagination()
+    page = paginator.build_page([order async for order in paginator.get_page_queryset(queryset, request)])
+    etag = make_etag(request, request.user.pk, page_validators(page, paginator.get_next_link(), paginator.get_previous_link()))
+    response = conditional(request, etag, None)
+    if response is None:
+        response = render(paginator.get_paginated_data(OrderListSerializer(page, many=True).data))
+    return with_validators(response, etag, None)
+
+
+@async_api_view()
+async def order_events(request):
+    # Server-sent events for the orders the user can see. Needs an ASGI
+    # server: each open feed is a coroutine waiting on its subscription, and
+    # the ASGI handler cancels it when the client disconnects. Under WSGI the
+    # feed would hold a worker thread for as long as the client stays, so it
+    # is refused.
+    if not isinstance(request, ASGIRequest):
+        return render({'detail': 'Order events need an ASGI server'}, status.HTTP_501_NOT_IMPLEMENTED)
+    roles = await aget_roles(request.user)
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+
+    async def stream():
+        broker = get_broker()
+        subscription = broker.subscribe(last_event_id)
+        try:
+            yield 'retry: %d\n\n' % settings.EVENTS_RETRY_MILLISECONDS
+            while True:
+                event = await subscription.get(settings.EVENTS_KEEPALIVE_SECONDS)
+                if event is CLOSED:
+                    break
+                if event is None:
+                    yield ': keepalive\n\n'
+                elif can_see(event, request.user, roles):
+                    yield 'id: %d\nevent: %s\ndata: %s\n\n' % (event['id'], event['type'], renderer.render(event).decode())
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def read_route(name, sync_view, async_view, sync_params=()):
+    # Serves GET/HEAD with async_view when the route is listed in
+    # ASYNC_READ_ROUTES and hands every other method, and any request using one
+    # of sync_params, to the synchronous view.
+    if name not in settings.ASYNC_READ_ROUTES:
+        return sync_view
+
+    @csrf_exempt
+    @functools.wraps(async_view)
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD') and not any(param in request.GET for param in sync_params):
+            return await async_view(request, *args, **kwargs)
+        return await sync_to_async(sync_view)(request, *args, **kwargs)
+    return view
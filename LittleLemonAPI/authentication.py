@@ -0,0 +1,133 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import BaseAuthentication, SessionAuthentication, TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .roles import aget_roles, get_roles, roles_version
+
+# Resolved users are kept in the default cache for AUTH_CACHE_TIMEOUT seconds
+# together with their group names, so an authenticated request needs no
+# user, token or group query. Keys embed the roles version, which group
+# changes bump; signals drop a single user's entry when it is saved, deleted
+# or moved between groups, and a token's entry when it is deleted.
+
+
+def user_key(pk):
+    return 'auth:user:%s:%s' % (roles_version(), pk)
+
+
+def token_key(key):
+    return 'auth:token:%s' % hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def get_user(pk):
+    timeout = settings.AUTH_CACHE_TIMEOUT
+    key = user_key(pk) if timeout else None
+    user = cache.get(key) if key else None
+    if user is None:
+        user = User.objects.filter(pk=pk).first()
+        if user is not None and key:
+            get_roles(user)
+            cache.set(key, user, timeout)
+    return user
+
+
+async def aget_user(pk):
+    timeout = settings.AUTH_CACHE_TIMEOUT
+    key = user_key(pk) if timeout else None
+    user = await cache.aget(key) if key else None
+    if user is None:
+        user = await User.objects.filter(pk=pk).afirst()
+        if user is not None and key:
+            await aget_roles(user)
+            await cache.aset(key, user, timeout)
+    return user
+
+
+def get_token_user_id(key):
+    timeout = settings.AUTH_CACHE_TIMEOUT
+    user_id = cache.get(token_key(key)) if timeout else None
+    if user_id is None:
+        user_id = Token.objects.filter(key=key).values_list('user_id', flat=True).first()
+        if user_id is not None and timeout:
+            cache.set(token_key(key), user_id, timeout)
+    return user_id
+
+
+async def aget_token_user_id(key):
+    timeout = settings.AUTH_CACHE_TIMEOUT
+    user_id = await cache.aget(token_key(key)) if timeout else None
+    if user_id is None:
+        user_id = await Token.objects.filter(key=key).values_list('user_id', flat=True).afirst()
+        if user_id is not None and timeout:
+            await cache.aset(token_key(key), user_id, timeout)
+    return user_id
+
+
+def forget_users(pks):
+    cache.delete_many([user_key(pk) for pk in pks])
+
+
+def forget_token(key):
+    cache.delete(token_key(key))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        # Users looked up by another field, or checked against their password
+        # hash, go through the uncached path.
+        if jwt_settings.USER_ID_FIELD not in ('id', 'pk') or jwt_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        user_id = get_token_user_id(key)
+        if user_id is None:
+            raise AuthenticationFailed(_('Invalid token.'))
+        user = get_user(user_id)
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return (user, Token(key=key, user=user))
+
+
+class HeaderAuthentication(BaseAuthentication):
+    # Picks the one authenticator the Authorization header asks for instead of
+    # trying JWT, token and session authentication in turn.
+    def __init__(self):
+        self.jwt = CachedJWTAuthentication()
+        self.token = CachedTokenAuthentication()
+        self.session = SessionAuthentication()
+
+    def authenticate(self, request):
+        header = get_authorization_header(request).split()
+        if not header:
+            return self.session.authenticate(request)
+        keyword = header[0]
+        if keyword in [header_type.encode() for header_type in jwt_settings.AUTH_HEADER_TYPES]:
+            return self.jwt.authenticate(request)
+        if keyword.lower() == self.token.keyword.lower().encode():
+            return self.token.authenticate(request)
+        return None
+
+    def authenticate_header(self, request):
+        return self.jwt.authenticate_header(request)
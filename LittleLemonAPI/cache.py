@@ -0,0 +1,124 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F, Max
+from django.http import HttpResponse
+from django.utils import timezone
+
+from LittleLemon.routers import primary
+
+MENU_CACHE = 'menu'
+STATE_ATTRIBUTE = '_catalogue_state'
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def menu_cache():
+    return caches[MENU_CACHE]
+
+
+# The catalogue version and the time of the latest catalogue write live in a
+# single CatalogueVersion row rather than in the menu cache, which is local to
+# each process by default: every worker sees a bump as soon as it commits.
+# They are read from the default database, once per request when a request
+# is given.
+
+def create_catalogue_state():
+    # Seeded from the clock so a recreated row never reuses a version that
+    # stale entries (or clients' ETags) were built from. Item deletes touch
+    # their category, so the column maxima also account for removed rows.
+    from .models import Category, CatalogueVersion, MenuItem
+    latest = [
+        MenuItem.objects.using(DEFAULT_DB_ALIAS).aggregate(latest=Max('updated_at'))['latest'],
+        Category.objects.using(DEFAULT_DB_ALIAS).aggregate(latest=Max('updated_at'))['latest'],
+    ]
+    modified = max([value for value in latest if value is not None], default=timezone.now())
+    state, _ = CatalogueVersion.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+        pk=1, defaults={'version': time.time_ns(), 'modified': modified})
+    return state.version, state.modified
+
+
+def get_catalogue_state(request=None):
+    state = getattr(request, STATE_ATTRIBUTE, None)
+    if state is None:
+        from .models import CatalogueVersion
+        row = CatalogueVersion.objects.using(DEFAULT_DB_ALIAS).filter(pk=1).values_list('version', 'modified').first()
+        version, modified = row or create_catalogue_state()
+        state = (version, modified.timestamp())
+        if request is not None:
+            setattr(request, STATE_ATTRIBUTE, state)
+    return state
+
+
+def get_catalogue_version(request=None):
+    return get_catalogue_state(request)[0]
+
+
+def get_catalogue_modified(request=None):
+    # Unix timestamp of the latest catalogue write.
+    return get_catalogue_state(request)[1]
+
+
+def bump_catalogue_version():
+    from .models import CatalogueVersion
+    updated = CatalogueVersion.objects.using(DEFAULT_DB_ALIAS).filter(pk=1).update(
+        version=F('version') + 1, modified=timezone.now())
+    if not updated:
+        create_catalogue_state()
+
+
+def catalogue_key(name, request, *parts):
+    params = sorted((key, value) for key in request.GET for value in request.GET.getlist(key))
+    # Paginated bodies carry absolute next/previous links, so the origin the
+    # client used is part of the key.
+    raw = repr((request.scheme, request.get_host(), parts, params, request.accepted_media_type))
+    digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    return 'catalogue:%s:%s:%s' % (get_catalogue_version(request), name, digest)
+
+
+def record(hit):
+    with _stats_lock:
+        _stats['hits' if hit else 'misses'] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+class CatalogueCacheMixin:
+    # Serves rendered menu payloads straight from the cache. Keys embed the
+    # catalogue version, which signals bump on every MenuItem/Category write,
+    # so stale entries are never read and simply age out. Misses are built
+    # from the default database, where the version is read, never a replica.
+    uncached_formats = ('api',)
+
+    def cached_response(self, request, name, build, *parts):
+        renderer = request.accepted_renderer
+        if renderer.format in self.uncached_formats:
+            return build()
+
+        cache = menu_cache()
+        key = catalogue_key(name, request, *parts)
+        cached = cache.get(key)
+        if cached is not None:
+            record(True)
+            content_type, content = cached
+            return HttpResponse(content, content_type=content_type)
+
+        record(False)
+        with primary():
+            response = build()
+        if response.status_code != 200:
+            return response
+        content = renderer.render(response.data, request.accepted_media_type, self.get_renderer_context())
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = '%s; charset=%s' % (content_type, renderer.charset)
+        cache.set(key, (content_type, content), settings.MENU_CACHE_TIMEOUT)
+        return HttpResponse(content, content_type=content_type)
@@ -0,0 +1,189 @@
+import csv
+import json
+from itertools import islice
+
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Greatest, Least, Round
+from django.utils import timezone
+from rest_framework.settings import api_settings
+
+from .cache import bump_catalogue_version
+from .models import Cart, Category, MenuItem
+from .search import index_items
+from .serializers import MenuItemImportSerializer
+
+FORMATS = ('jsonl', 'csv')
+CHUNK_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = ('id', 'title', 'price', 'featured', 'category_slug', 'category_title')
+MAX_REPORTED_ERRORS = 100
+MAX_PRICE = Decimal('9999.99')
+
+
+class InvalidRow:
+    # A line read_rows couldn't decode or parse; import_menu reports it like a
+    # row that fails validation.
+    def __init__(self, message):
+        self.errors = {api_settings.NON_FIELD_ERRORS_KEY: [message]}
+
+
+def is_decoded(value):
+    # Callers decode with errors='surrogateescape', which turns bytes that
+    # aren't UTF-8 into lone surrogates instead of raising mid-stream.
+    try:
+        value.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def read_rows(lines, format):
+    # lines is any iterable of text lines decoded with
+    # errors='surrogateescape', e.g. a file or a decoded request body.
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            if all(is_decoded(value) for value in row.values() if isinstance(value, str)):
+                yield row
+            else:
+                yield InvalidRow('Line %d is not valid UTF-8' % reader.line_num)
+        return
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if not is_decoded(line):
+            yield InvalidRow('Line %d is not valid UTF-8' % number)
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield InvalidRow('Line %d is not valid JSON' % number)
+
+
+def categories_for_slugs(slugs, titles):
+    # One query for existing slugs and one bulk insert for the missing ones.
+    categories = {}
+    for category in Category.objects.filter(slug__in=slugs).order_by('-id'):
+        categories[category.slug] = category
+    missing = [Category(slug=slug, title=titles.get(slug) or slug) for slug in slugs if slug not in categories]
+    for category in Category.objects.bulk_create(missing):
+        categories[category.slug] = category
+    return categories
+
+
+def write_chunk(rows):
+    rows = {row['title']: row for row in rows}
+    slugs = {row['category_slug'] for row in rows.values()}
+    titles = {row['category_slug']: row.get('category_title') for row in rows.values()}
+
+    with transaction.atomic():
+        categories = categories_for_slugs(slugs, titles)
+        existing = {}
+        for item in MenuItem.objects.filter(title__in=rows.keys()).order_by('-id'):
+            existing[item.title] = item
+
+        now = timezone.now()
+        created, updated = [], []
+        for title, row in rows.items():
+            category = categories[row['category_slug']]
+            item = existing.get(title)
+            if item is None:
+                created.append(MenuItem(title=title, price=row['price'], featured=row['featured'], category=category))
+            else:
+                item.price, item.featured, item.category, item.updated_at = row['price'], row['featured'], category, now
+                updated.append(item)
+
+        MenuItem.objects.bulk_create(created)
+        MenuItem.objects.bulk_update(updated, ['price', 'featured', 'category', 'updated_at'])
+        if updated:
+            reprice_carts(MenuItem.objects.filter(pk__in=[item.pk for item in updated]))
+        # Bulk writes skip model signals, so update the search index and
+        # invalidate the menu cache here.
+        index_items([item.pk for item in created + updated])
+        transaction.on_commit(bump_catalogue_version)
+    return len(created), len(updated)
+
+
+def reprice_carts(items):
+    # Brings cart rows for the items queryset up to the current menu prices
+    # with one UPDATE, however many carts hold them.
+    price = Subquery(MenuItem.objects.filter(pk=OuterRef('menuitem_id')).values('price')[:1])
+    return Cart.objects.filter(menuitem__in=items.values('pk')).update(unit_price=price, price=price * F('quantity'))
+
+
+def change_prices(items, percent=None, amount=None):
+    # Changes the price of every item in the queryset by a percentage or a
+    # fixed amount, clamped to what the price column holds, and reprices the
+    # carts holding them. Returns (items, carts) updated.
+    field = models.DecimalField(max_digits=6, decimal_places=2)
+    if percent is not None:
+        price = F('price') * Value(1 + Decimal(percent) / 100, output_field=field)
+    else:
+        price = F('price') + Value(Decimal(amount), output_field=field)
+    price = Least(Greatest(Round(price, 2, output_field=field), Value(Decimal('0'), output_field=field)),
+                  Value(MAX_PRICE, output_field=field))
+
+    with transaction.atomic():
+        changed = items.update(price=price, updated_at=timezone.now())
+        carts = reprice_carts(items) if changed else 0
+        transaction.on_commit(bump_catalogue_version)
+    return changed, carts
+
+
+def import_menu(rows, chunk_size=CHUNK_SIZE):
+    # Validates and writes rows chunk by chunk so memory stays bounded by the
+    # chunk size. Invalid rows, including lines read_rows couldn't parse, are
+    # skipped and reported.
+    result = {'created': 0, 'updated': 0, 'invalid': 0, 'errors': []}
+    rows = iter(rows)
+    number = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        valid = []
+        for row in chunk:
+            number += 1
+            if isinstance(row, InvalidRow):
+                errors = row.errors
+            else:
+                serializer = MenuItemImportSerializer(data=row)
+                if serializer.is_valid():
+                    valid.append(serializer.validated_data)
+                    continue
+                errors = serializer.errors
+            result['invalid'] += 1
+            if len(result['errors']) < MAX_REPORTED_ERRORS:
+                result['errors'].append({'row': number, 'errors': errors})
+        if valid:
+            created, updated = write_chunk(valid)
+            result['created'] += created
+            result['updated'] += updated
+    return result
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def export_menu(format):
+    # Yields the catalogue as text lines from a server-side iterator, so the
+    # full table is never held in memory.
+    rows = (MenuItem.objects.order_by('id')
+            .values_list('id', 'title', 'price', 'featured', 'category__slug', 'category__title')
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+        return
+    for row in rows:
+        data = dict(zip(EXPORT_FIELDS, row))
+        data['price'] = str(data['price'])
+        yield json.dumps(data) + '\n'
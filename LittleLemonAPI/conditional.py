@@ -0,0 +1,82 @@
+import hashlib
+from datetime import datetime
+
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from .cache import get_catalogue_modified, get_catalogue_version
+
+
+def make_etag(request, *parts):
+    params = sorted((key, value) for key in request.GET for value in request.GET.getlist(key))
+    raw = repr((parts, params, request.accepted_media_type))
+    return quote_etag(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+class ConditionalGetMixin:
+    # Answers If-None-Match / If-Modified-Since with 304 after authentication
+    # but before the queryset is serialized.
+
+    def get_etag(self, request, *args, **kwargs):
+        return None
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return None
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request, *args, **kwargs)
+        last_modified = self.get_last_modified(request, *args, **kwargs)
+        if isinstance(last_modified, datetime):
+            last_modified = last_modified.timestamp()
+        if last_modified is not None:
+            last_modified = int(last_modified)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            if etag and not response.has_header('ETag'):
+                response.headers['ETag'] = etag
+            if last_modified is not None and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class CatalogueConditionalMixin(ConditionalGetMixin):
+    # Menu validators come from the catalogue version: one primary key lookup,
+    # shared with the payload cache key.
+
+    def get_etag(self, request, *args, **kwargs):
+        return make_etag(request, 'catalogue', get_catalogue_version(request), kwargs.get('pk'))
+
+    def get_last_modified(self, request, *args, **kwargs):
+        return get_catalogue_modified(request)
+
+
+def page_validators(page, next_link, previous_link):
+    # What a paginated list's ETag is built from: the rows on the page with
+    # their updated_at, and the links around it.
+    return [(row.pk, row.updated_at) for row in page], next_link, previous_link
+
+
+class PageConditionalMixin:
+    # For keyset-paginated lists of rows with an updated_at column: the ETag
+    # is built from the page being returned, so a conditional GET costs the
+    # page query and skips serialization. There is no Last-Modified, since a
+    # deleted row can leave the newest updated_at on a page unchanged.
+
+    def get_etag_parts(self, request, page):
+        return page_validators(page, self.paginator.get_next_link(), self.paginator.get_previous_link())
+
+    def serialize_page(self, page):
+        return self.get_serializer(page, many=True).data
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        etag = make_etag(request, request.user.pk, self.get_etag_parts(request, page))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = self.get_paginated_response(self.serialize_page(page))
+        if response.status_code in (200, 304):
+            response.headers['ETag'] = etag
+        return response
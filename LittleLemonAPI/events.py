@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .roles import DELIVERY_CREW, MANAGER
+from .serializers import OrderListSerializer
+
+# Order events for the live feed at /api/orders/events. Views publish after
+# their transaction commits; every open feed is a Subscription on the broker
+# named by EVENTS_BROKER and filters events for its user.
+#
+# InProcessBroker only reaches feeds served by the same process. Multi-process
+# deployments can plug in a broker backed by Redis pub/sub or PostgreSQL
+# LISTEN/NOTIFY by implementing publish, subscribe and unsubscribe.
+
+ORDER_CREATED = 'order-created'
+CREW_ASSIGNED = 'crew-assigned'
+STATUS_CHANGED = 'status-changed'
+
+CLOSED = object()
+
+
+class Subscription:
+    # Events are handed over from whichever thread published them to the
+    # event loop that serves the feed. A subscriber that falls behind is
+    # closed; its client reconnects with Last-Event-ID and gets the backlog.
+    def __init__(self, loop, maxsize=100):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def deliver(self, event):
+        self.loop.call_soon_threadsafe(self.put, event)
+
+    def put(self, event):
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = CLOSED
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout):
+        # The next event, None on timeout, or CLOSED.
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    def publish(self, event):
+        raise NotImplementedError
+
+    def subscribe(self, last_event_id=None):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class InProcessBroker(Broker):
+    history_size = 256
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.history = deque(maxlen=self.history_size)
+
+    def publish(self, event):
+        with self.lock:
+            self.history.append(event)
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # Its event loop has closed.
+                self.unsubscribe(subscription)
+
+    def subscribe(self, last_event_id=None):
+        # Must be called from the event loop that will read the subscription.
+        subscription = Subscription(asyncio.get_running_loop())
+        with self.lock:
+            self.subscribers.add(subscription)
+            backlog = [event for event in self.history if event['id'] > last_event_id] if last_event_id is not None else []
+        for event in backlog:
+            subscription.put(event)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+_last_id = 0
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.EVENTS_BROKER)()
+    return _broker
+
+
+def next_event_id():
+    # Clock based, so ids keep increasing across restarts and a reconnecting
+    # client's Last-Event-ID never skips new events.
+    global _last_id
+    with _broker_lock:
+        _last_id = max(_last_id + 1, time.time_ns() // 1000)
+        return _last_id
+
+
+def order_event(type, order, **extra):
+    return dict(id=next_event_id(), type=type, order=dict(id=order.id, **OrderListSerializer(order).data), **extra)
+
+
+def publish_order(type, order, **extra):
+    event = order_event(type, order, **extra)
+    transaction.on_commit(lambda: get_broker().publish(event))
+
+
+def can_see(event, user, roles):
+    order = event['order']
+    if MANAGER in roles:
+        return True
+    if DELIVERY_CREW in roles:
+        return user.pk in (order['delivery_crew'], event.get('previous_delivery_crew'))
+    return order['user'] == user.pk
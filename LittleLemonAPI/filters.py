@@ -0,0 +1,130 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+MENU_ITEM_ORDERING = ('price', '-price', 'title', '-title')
+TRUE_VALUES = ('1', 'true', 'yes')
+FALSE_VALUES = ('0', 'false', 'no')
+
+
+def parse_bool(params, name):
+    value = params.get(name)
+    if value is None or value == '':
+        return None
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValidationError({name: 'Expected true or false'})
+
+
+def parse_decimal(params, name):
+    value = params.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        number = None
+    if number is None or not number.is_finite():
+        raise ValidationError({name: 'Expected a number'})
+    return number
+
+
+def parse_int(params, name, minimum, maximum):
+    value = params.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+    if number is None or not minimum <= number <= maximum:
+        raise ValidationError({name: 'Expected a whole number from %d to %d' % (minimum, maximum)})
+    return number
+
+
+def parse_date_param(params, name):
+    value = params.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Expected a date as YYYY-MM-DD'})
+    return parsed
+
+
+def filter_menu_items(queryset, params):
+    # Every filter and sort key below is backed by an index on MenuItem or
+    # Category except search, whose substring match scans; menu-items/search
+    # is the indexed alternative.
+    category = params.get('category')
+    if category:
+        if category.isdigit():
+            queryset = queryset.filter(category_id=category)
+        else:
+            queryset = queryset.filter(category__slug=category)
+
+    featured = parse_bool(params, 'featured')
+    if featured is not None:
+        queryset = queryset.filter(featured=featured)
+
+    price_min = parse_decimal(params, 'price_min')
+    if price_min is not None:
+        queryset = queryset.filter(price__gte=price_min)
+    price_max = parse_decimal(params, 'price_max')
+    if price_max is not None:
+        queryset = queryset.filter(price__lte=price_max)
+
+    title = params.get('title')
+    if title:
+        queryset = queryset.filter(title__startswith=title)
+
+    search = params.get('search')
+    if search:
+        queryset = queryset.filter(Q(title__icontains=search) | Q(category__title__icontains=search))
+
+    ordering = params.get('ordering')
+    if ordering:
+        if ordering not in MENU_ITEM_ORDERING:
+            raise ValidationError({'ordering': 'Expected one of ' + ', '.join(MENU_ITEM_ORDERING)})
+        queryset = queryset.order_by(ordering)
+    return queryset
+
+
+class MenuItemFilter(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        return filter_menu_items(queryset, request.query_params)
+
+
+def filter_orders(queryset, params):
+    # date and status are both indexed on Order.
+    queryset = filter_report_dates(queryset, params)
+
+    status = parse_bool(params, 'status')
+    if status is not None:
+        # status=True compiles to a bare WHERE status on SQLite, which can't
+        # use an index; status IN (1) can.
+        queryset = queryset.filter(status__in=[status])
+    return queryset
+
+
+class OrderFilter(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        return filter_orders(queryset, request.query_params)
+
+
+def filter_report_dates(queryset, params):
+    date_from = parse_date_param(params, 'date_from')
+    if date_from is not None:
+        queryset = queryset.filter(date__gte=date_from)
+    date_to = parse_date_param(params, 'date_to')
+    if date_to is not None:
+        queryset = queryset.filter(date__lte=date_to)
+    return queryset
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.assignment import ASSIGN_BATCH_SIZE, assign_orders
+
+
+class Command(BaseCommand):
+    help = 'Assign unassigned open orders to the delivery crew members with the fewest open orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help='Assign at most this many orders')
+        parser.add_argument('--batch-size', type=int, default=ASSIGN_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        assigned = assign_orders(options['limit'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Assigned %d orders to %d crew members' % (sum(assigned.values()), len(assigned))))
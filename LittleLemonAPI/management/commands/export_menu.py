@@ -0,0 +1,20 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.catalogue import FORMATS, export_menu
+
+
+class Command(BaseCommand):
+    help = 'Stream the menu catalogue as JSON Lines or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Defaults to stdout')
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+
+    def handle(self, *args, **options):
+        if not options['path']:
+            sys.stdout.writelines(export_menu(options['format']))
+            return
+        with open(options['path'], 'w', encoding='utf-8', newline='') as output:
+            output.writelines(export_menu(options['format']))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI.catalogue import CHUNK_SIZE, FORMATS, import_menu, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Bulk import menu items from a JSON Lines or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        try:
+            with open(path, encoding='utf-8', errors='surrogateescape', newline='') as lines:
+                result = import_menu(read_rows(lines, format), chunk_size=options['chunk_size'])
+        except OSError as error:
+            raise CommandError(error)
+
+        for error in result['errors']:
+            self.stderr.write('Row %(row)d: %(errors)s' % error)
+        self.stdout.write(self.style.SUCCESS(
+            'Created %(created)d, updated %(updated)d, skipped %(invalid)d invalid rows' % result))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI.models import DailyCrewOrders, DailyMenuItemSales, DailySales
+from LittleLemonAPI.reports import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales, menu item and crew rollups from all orders'
+
+    def handle(self, *args, **options):
+        rebuild()
+        self.stdout.write(self.style.SUCCESS('Rebuilt %d days, %d menu item rows, %d crew rows' % (
+            DailySales.objects.count(), DailyMenuItemSales.objects.count(), DailyCrewOrders.objects.count())))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI.search import backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Refill the menu search index from the menu items and categories'
+
+    def handle(self, *args, **options):
+        if backend() is None:
+            raise CommandError('The search index needs SQLite 3.34+ or PostgreSQL')
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Rebuilt the menu search index'))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from LittleLemonAPI.tasks import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs, polling for new ones until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once no jobs are due')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait between polls')
+
+    def handle(self, *args, **options):
+        while True:
+            # A long-lived worker gets no request_started/request_finished
+            # signals, so drop connections past CONN_MAX_AGE or left broken by
+            # a restarted database here, as a request would.
+            close_old_connections()
+            succeeded, failed = run_pending(options['batch_size'])
+            if succeeded or failed:
+                self.stdout.write('Ran %d jobs, %d failed' % (succeeded + failed, failed))
+            if options['once']:
+                return
+            try:
+                time.sleep(options['sleep'])
+            except KeyboardInterrupt:
+                return
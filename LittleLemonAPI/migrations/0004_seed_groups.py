@@ -0,0 +1,21 @@
+from django.db import migrations
+
+GROUPS = ('Manager', 'Delivery Crew')
+
+
+def create_groups(apps, schema_editor):
+    Group = apps.get_model('auth', 'Group')
+    for name in GROUPS:
+        Group.objects.using(schema_editor.connection.alias).get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('LittleLemonAPI', '0003_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_groups, migrations.RunPython.noop),
+    ]
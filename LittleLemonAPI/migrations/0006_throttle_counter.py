@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0005_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThrottleCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('period', models.BigIntegerField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('previous_hits', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
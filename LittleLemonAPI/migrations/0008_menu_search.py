@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# The search index has no model: on SQLite it is an FTS5 table using the
+# trigram tokenizer (SQLite 3.34+), on PostgreSQL a table with a tsvector
+# column and a pg_trgm index. Other databases get no table and search falls
+# back to LIKE queries. Creating the pg_trgm extension needs a role allowed
+# to do so.
+
+SQLITE_CREATE = '''
+CREATE VIRTUAL TABLE "LittleLemonAPI_menusearch" USING fts5(title, category, tokenize='trigram')
+'''
+SQLITE_FILL = '''
+INSERT INTO "LittleLemonAPI_menusearch" (rowid, title, category)
+SELECT m.id, m.title, c.title FROM "LittleLemonAPI_menuitem" m JOIN "LittleLemonAPI_category" c ON c.id = m.category_id
+'''
+
+POSTGRESQL_CREATE = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    '''
+    CREATE TABLE "LittleLemonAPI_menusearch" (
+        menuitem_id bigint PRIMARY KEY REFERENCES "LittleLemonAPI_menuitem" (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        title text NOT NULL,
+        category text NOT NULL,
+        document tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', title), 'A') || setweight(to_tsvector('simple', category), 'B')
+        ) STORED
+    )
+    ''',
+    'CREATE INDEX "LittleLemonAPI_menusearch_document" ON "LittleLemonAPI_menusearch" USING gin (document)',
+    '''
+    CREATE INDEX "LittleLemonAPI_menusearch_trigram" ON "LittleLemonAPI_menusearch"
+    USING gin ((title || ' ' || category) gin_trgm_ops)
+    ''',
+]
+POSTGRESQL_FILL = '''
+INSERT INTO "LittleLemonAPI_menusearch" (menuitem_id, title, category)
+SELECT m.id, m.title, c.title FROM "LittleLemonAPI_menuitem" m JOIN "LittleLemonAPI_category" c ON c.id = m.category_id
+'''
+
+DROP = 'DROP TABLE IF EXISTS "LittleLemonAPI_menusearch"'
+
+
+def create_search_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        statements = POSTGRESQL_CREATE + [POSTGRESQL_FILL]
+    elif connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 34, 0):
+        statements = [SQLITE_CREATE, SQLITE_FILL]
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute(DROP)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0007_job_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
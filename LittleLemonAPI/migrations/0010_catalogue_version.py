@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:24
+
+import time
+
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+
+
+def create_version(apps, schema_editor):
+    # The row LittleLemonAPI.cache reads on every catalogue request, seeded
+    # from the clock and the latest catalogue write.
+    latest = [
+        apps.get_model('LittleLemonAPI', model).objects.aggregate(latest=Max('updated_at'))['latest']
+        for model in ('MenuItem', 'Category')
+    ]
+    apps.get_model('LittleLemonAPI', 'CatalogueVersion').objects.create(
+        pk=1, version=time.time_ns(), modified=max([value for value in latest if value is not None], default=timezone.now()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0009_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField()),
+                ('modified', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
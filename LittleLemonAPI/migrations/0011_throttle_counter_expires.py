@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0010_catalogue_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='throttlecounter',
+            name='expires',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+    ]
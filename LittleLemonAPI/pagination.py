@@ -0,0 +1,196 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ResultsPagination(BasePagination):
+    # Page size handling and the {next, previous, results} envelope shared by
+    # the paginators below.
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class KeysetPagination(ResultsPagination):
+    # Seeks past the last row seen using the queryset's ordering instead of
+    # OFFSET, so every page costs the same index range scan however deep it is.
+    # The primary key is always appended as a tie-breaker.
+    cursor_query_param = 'cursor'
+    ordering = ('id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.build_page(list(self.get_page_queryset(queryset, request)))
+
+    def get_page_queryset(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.fields = self.get_ordering(queryset)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = bool(self.cursor and self.cursor['reverse'])
+        if reverse:
+            queryset = queryset.order_by(*[('' if desc else '-') + name for name, desc in self.fields])
+        else:
+            queryset = queryset.order_by(*[('-' if desc else '') + name for name, desc in self.fields])
+        if self.cursor:
+            try:
+                queryset = queryset.filter(self.seek(self.cursor['values'], reverse))
+            except (ValidationError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return queryset[:self.page_size + 1]
+
+    def build_page(self, rows):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_cursor = self.previous_cursor = None
+
+        if self.cursor and self.cursor['reverse']:
+            rows.reverse()
+            if rows:
+                self.next_cursor = self.encode_cursor(rows[-1], False)
+                if has_more:
+                    self.previous_cursor = self.encode_cursor(rows[0], True)
+        elif rows:
+            if has_more:
+                self.next_cursor = self.encode_cursor(rows[-1], False)
+            if self.cursor:
+                self.previous_cursor = self.encode_cursor(rows[0], True)
+        return rows
+
+    def get_ordering(self, queryset):
+        ordering = [o for o in queryset.query.order_by if isinstance(o, str)] or list(self.ordering)
+        fields = []
+        for name in ordering:
+            desc = name.startswith('-')
+            name = name.lstrip('-')
+            if name == 'pk':
+                name = 'id'
+            fields.append((name, desc))
+        if 'id' not in [name for name, desc in fields]:
+            fields.append(('id', fields[0][1] if fields else False))
+        return fields
+
+    def seek(self, values, reverse):
+        # (a > x) OR (a = x AND b > y) OR ... for ORDER BY a, b, ...
+        # The redundant leading a >= x lets the database range-scan the index on a.
+        condition = Q()
+        for i, (name, desc) in enumerate(self.fields):
+            lookup = 'lt' if desc != reverse else 'gt'
+            term = Q(**{name + '__' + lookup: values[i]})
+            for j, (previous, _) in enumerate(self.fields[:i]):
+                term &= Q(**{previous: values[j]})
+            condition |= term
+        name, desc = self.fields[0]
+        return Q(**{name + ('__lte' if desc != reverse else '__gte'): values[0]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.GET.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values, reverse = cursor['v'], bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        # encode_cursor only writes strings; anything else would reach the
+        # query as a lookup value.
+        if (not isinstance(values, list) or len(values) != len(self.fields)
+                or not all(isinstance(value, str) for value in values)):
+            raise NotFound(self.invalid_cursor_message)
+        return {'values': values, 'reverse': reverse}
+
+    def encode_cursor(self, row, reverse):
+        values = [str(getattr(row, name)) for name, desc in self.fields]
+        data = {'v': values}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        return self.next_cursor
+
+    def get_previous_link(self):
+        return self.previous_cursor
+
+
+class MenuItemPagination(KeysetPagination):
+    ordering = ('price', 'id')
+
+
+class OrderPagination(KeysetPagination):
+    ordering = ('-date', '-id')
+
+
+class SearchPagination(ResultsPagination):
+    # Ranked results have no column to seek on, so search pages by number.
+    # Results past the first few pages are rarely wanted, hence max_page.
+    max_page_size = 50
+    max_page = 50
+    page_query_param = 'page'
+
+    def paginate_search(self, search, request):
+        # search(limit, offset) returns ranked ids; one extra tells whether
+        # there is a next page.
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        try:
+            self.page = min(max(int(request.GET.get(self.page_query_param, 1)), 1), self.max_page)
+        except ValueError:
+            self.page = 1
+        ids = search(self.page_size + 1, (self.page - 1) * self.page_size)
+        self.has_next = len(ids) > self.page_size and self.page < self.max_page
+        return ids[:self.page_size]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.page_query_param, self.page + 1)
+
+    def get_previous_link(self):
+        if self.page == 1:
+            return None
+        if self.page == 2:
+            return remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(self.base_url, self.page_query_param, self.page - 1)
+
@@ -1,9 +1,17 @@
 from rest_framework import permissions
+from .roles import is_delivery_crew, is_manager
 
 class IsManager(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Manager').exists()
+        return is_manager(request.user)
     
 class IsDeliveryCrew(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.groups.filter(name='Delivery Crew').exists()
+        return is_delivery_crew(request.user)
+
+class IsOrderOwner(permissions.BasePermission):
+    # For views with get_order(). List it after IsAuthenticated so the order
+    # is only looked up for authenticated users and an anonymous caller
+    # can't tell existing order ids from missing ones.
+    def has_permission(self, request, view):
+        return view.get_order().user_id == request.user.pk
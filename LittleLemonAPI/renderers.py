@@ -0,0 +1,59 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# orjson and msgpack are optional: without orjson FastJSONRenderer reuses one
+# stdlib encoder instead of building a new one per response, and
+# MsgPackRenderer is only offered when msgpack is installed.
+
+default_encoder = encoders.JSONEncoder()
+if orjson is not None:
+    # Leave datetimes to DRF's encoder so both paths format them alike.
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def encode_default(value):
+    # Decimals, lazy strings, querysets and the like, as DRF encodes them.
+    return default_encoder.default(value)
+
+
+class FastJSONRenderer(JSONRenderer):
+    # Same output as JSONRenderer for compact responses; indented responses
+    # (the browsable API, or ?indent=) take the regular path.
+    def __init__(self):
+        self.encoder = self.encoder_class(
+            ensure_ascii=self.ensure_ascii, allow_nan=not self.strict,
+            separators=(',', ':') if self.compact else (', ', ': '))
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if orjson is not None and self.compact and not self.ensure_ascii:
+            ret = orjson.dumps(data, default=encode_default, option=ORJSON_OPTIONS)
+            return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        ret = self.encoder.encode(data)
+        return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+class MsgPackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default)
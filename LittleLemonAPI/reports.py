@@ -0,0 +1,159 @@
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+
+from .models import DailyCrewOrders, DailyMenuItemSales, DailySales, Job, Order, OrderItem
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def add_to_rollups(date, orders, items, revenue, menuitems):
+    # menuitems maps menu item ids to (quantity, revenue). Rows are created
+    # empty if missing and then incremented in place, so the cost is a fixed
+    # number of queries however many lines the order had.
+    DailySales.objects.bulk_create([DailySales(date=date)], ignore_conflicts=True)
+    DailySales.objects.filter(date=date).update(
+        orders=F('orders') + orders, items=F('items') + items, revenue=F('revenue') + revenue)
+    if not menuitems:
+        return
+
+    DailyMenuItemSales.objects.bulk_create(
+        [DailyMenuItemSales(date=date, menuitem_id=menuitem_id) for menuitem_id in menuitems],
+        ignore_conflicts=True)
+    DailyMenuItemSales.objects.filter(date=date, menuitem_id__in=menuitems).update(
+        quantity=F('quantity') + Case(
+            *[When(menuitem_id=key, then=Value(quantity)) for key, (quantity, _) in menuitems.items()],
+            default=Value(0), output_field=models.IntegerField()),
+        revenue=F('revenue') + Case(
+            *[When(menuitem_id=key, then=Value(revenue)) for key, (_, revenue) in menuitems.items()],
+            default=Value(0), output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+    )
+
+
+def line_totals(rows, sign=1):
+    menuitems = {}
+    for row in rows:
+        quantity, revenue = menuitems.get(row['menuitem_id'], (0, 0))
+        menuitems[row['menuitem_id']] = (quantity + sign * row['quantity'], revenue + sign * row['price'])
+    return menuitems
+
+
+def record_sales(date, total, rows):
+    # rows are the order's lines as dicts with menuitem_id, quantity and price.
+    menuitems = line_totals(rows)
+    add_to_rollups(date, 1, sum(quantity for quantity, _ in menuitems.values()), total, menuitems)
+
+
+def record_order(order, rows):
+    record_sales(order.date, order.total, rows)
+
+
+def sales_job_key(order_id):
+    return 'record_sales:%d' % order_id
+
+
+def forget_sales(date, total, rows):
+    menuitems = line_totals(rows, sign=-1)
+    add_to_rollups(date, -1, sum(quantity for quantity, _ in menuitems.values()), -total, menuitems)
+
+
+def forget_order(order):
+    # Checkout records sales through a job. If it hasn't counted this order
+    # yet, drop it instead of subtracting totals that were never added; if it
+    # is running right now, subtract once it has finished.
+    from .tasks import enqueue
+
+    jobs = Job.objects.filter(key=sales_job_key(order.pk))
+    status = jobs.values_list('status', flat=True).first()
+    cancelled = status in (Job.QUEUED, Job.FAILED) and jobs.filter(status=status).delete()[0]
+    if not cancelled:
+        rows = list(OrderItem.objects.filter(order=order).values('menuitem_id', 'quantity', 'price'))
+        if status in (None, Job.DONE):
+            forget_sales(order.date, order.total, rows)
+        else:
+            # Running, or claimed by a worker since its status was read.
+            enqueue('forget_sales', {'order': order.pk, 'date': order.date, 'total': order.total, 'lines': rows},
+                    delay=timedelta(seconds=settings.JOBS_RETRY_DELAY_SECONDS))
+    if order.delivery_crew_id:
+        record_assignment(order.date, order.delivery_crew_id, None)
+
+
+def record_assignment(date, old_crew_id, new_crew_id):
+    if old_crew_id == new_crew_id:
+        return
+    if old_crew_id:
+        DailyCrewOrders.objects.filter(date=date, delivery_crew_id=old_crew_id).update(orders=F('orders') - 1)
+    if new_crew_id:
+        DailyCrewOrders.objects.bulk_create(
+            [DailyCrewOrders(date=date, delivery_crew_id=new_crew_id)], ignore_conflicts=True)
+        DailyCrewOrders.objects.filter(date=date, delivery_crew_id=new_crew_id).update(orders=F('orders') + 1)
+
+
+def record_assignments(counts):
+    # counts maps (date, crew id) to the number of orders newly assigned.
+    # Rows are created empty if missing, then each date is incremented with
+    # one statement, so a batch costs a query per distinct date.
+    if not counts:
+        return
+    DailyCrewOrders.objects.bulk_create(
+        [DailyCrewOrders(date=date, delivery_crew_id=crew_id) for date, crew_id in counts], ignore_conflicts=True)
+    dates = {}
+    for (date, crew_id), orders in counts.items():
+        dates.setdefault(date, {})[crew_id] = orders
+    for date, crews in dates.items():
+        DailyCrewOrders.objects.filter(date=date, delivery_crew_id__in=crews).update(
+            orders=F('orders') + Case(
+                *[When(delivery_crew_id=crew_id, then=Value(orders)) for crew_id, orders in crews.items()],
+                default=Value(0), output_field=models.IntegerField()))
+
+
+def rebuild():
+    # Recomputes every rollup from the order tables in a handful of grouped
+    # queries; used after deploying the reports or repairing drift.
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        DailyMenuItemSales.objects.all().delete()
+        DailyCrewOrders.objects.all().delete()
+
+        items = dict(OrderItem.objects.values_list('order__date').annotate(Sum('quantity')).order_by())
+        DailySales.objects.bulk_create([
+            DailySales(date=row['date'], orders=row['orders'], items=items.get(row['date']) or 0, revenue=row['revenue'])
+            for row in Order.objects.values('date').annotate(orders=Count('id'), revenue=Sum('total')).order_by()
+        ], batch_size=REBUILD_BATCH_SIZE)
+
+        rows = (OrderItem.objects.values('order__date', 'menuitem_id')
+                .annotate(quantity=Sum('quantity'), revenue=Sum('price')).order_by()
+                .iterator(chunk_size=REBUILD_BATCH_SIZE))
+        while True:
+            batch = list(islice(rows, REBUILD_BATCH_SIZE))
+            if not batch:
+                break
+            DailyMenuItemSales.objects.bulk_create([
+                DailyMenuItemSales(date=row['order__date'], menuitem_id=row['menuitem_id'],
+                                   quantity=row['quantity'], revenue=row['revenue'])
+                for row in batch
+            ])
+
+        DailyCrewOrders.objects.bulk_create([
+            DailyCrewOrders(date=row['date'], delivery_crew_id=row['delivery_crew'], orders=row['orders'])
+            for row in Order.objects.filter(delivery_crew__isnull=False)
+            .values('date', 'delivery_crew').annotate(orders=Count('id')).order_by()
+        ], batch_size=REBUILD_BATCH_SIZE)
+
+
+def daily_sales(queryset):
+    return queryset.order_by('date').values('date', 'orders', 'items', 'revenue')
+
+
+def top_menu_items(queryset, limit):
+    return (queryset.values('menuitem_id', 'menuitem__title')
+            .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+            .order_by('-quantity', 'menuitem_id')[:limit])
+
+
+def crew_orders(queryset):
+    return (queryset.values('delivery_crew_id', 'delivery_crew__username')
+            .annotate(orders=Sum('orders')).order_by('-orders', 'delivery_crew_id'))
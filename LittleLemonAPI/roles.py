@@ -0,0 +1,102 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+
+MANAGER = 'Manager'
+DELIVERY_CREW = 'Delivery Crew'
+VERSION_KEY = 'roles:version'
+
+_groups = {}
+# Reentrant: creating a missing group fires post_save, whose handler calls
+# forget_groups() while get_group still holds the lock.
+_groups_lock = threading.RLock()
+
+
+def get_group(name):
+    # Process-wide registry of Group rows, filled on first use rather than at
+    # import so URLconf loading never touches the database.
+    group = _groups.get(name)
+    if group is None:
+        with _groups_lock:
+            group = _groups.get(name)
+            if group is None:
+                group, _ = Group.objects.get_or_create(name=name)
+                _groups[name] = group
+    return group
+
+
+def forget_groups():
+    with _groups_lock:
+        _groups.clear()
+
+
+def roles_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def roles_key(user_id):
+    return 'roles:%s:%s' % (roles_version(), user_id)
+
+
+def get_roles(user):
+    # Group names for the user, memoized on the user object (so once per
+    # request) and, when ROLE_CACHE_TIMEOUT is set, across requests too.
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        timeout = settings.ROLE_CACHE_TIMEOUT
+        key = roles_key(user.pk) if timeout else None
+        roles = cache.get(key) if key else None
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            if key:
+                cache.set(key, roles, timeout)
+        user._roles = roles
+    return roles
+
+
+async def aget_roles(user):
+    # get_roles for async views; shares the per-request memo and the cache.
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        timeout = settings.ROLE_CACHE_TIMEOUT
+        key = roles_key(user.pk) if timeout else None
+        roles = await cache.aget(key) if key else None
+        if roles is None:
+            roles = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+            if key:
+                await cache.aset(key, roles, timeout)
+        user._roles = roles
+    return roles
+
+
+def has_role(user, role):
+    return role in get_roles(user)
+
+
+def is_manager(user):
+    return has_role(user, MANAGER)
+
+
+def is_delivery_crew(user):
+    return has_role(user, DELIVERY_CREW)
+
+
+def invalidate_roles(user_ids=None):
+    if user_ids is None:
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            pass
+    else:
+        cache.delete_many([roles_key(user_id) for user_id in user_ids])
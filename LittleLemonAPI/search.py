@@ -0,0 +1,122 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import MenuItem
+
+# Menu search over item and category titles. The index table is created by
+# migration 0008: FTS5 with trigrams on SQLite, tsvector plus pg_trgm on
+# PostgreSQL. Signals keep it in step with single-row writes; bulk writers
+# (the menu importer) call index_items themselves, and `manage.py
+# rebuild_search` refills it from scratch.
+#
+# Typos are tolerated by matching on trigrams: on SQLite the query's trigrams
+# are ORed together and bm25 ranks items sharing the most of them first; on
+# PostgreSQL word similarity does the same job next to the tsvector match.
+
+TABLE = '"LittleLemonAPI_menusearch"'
+SOURCE = '''
+SELECT m.id, m.title, c.title FROM "LittleLemonAPI_menuitem" m
+JOIN "LittleLemonAPI_category" c ON c.id = m.category_id {where}
+'''
+
+SQLITE_UPSERT = 'INSERT OR REPLACE INTO %s (rowid, title, category) %s' % (TABLE, SOURCE)
+SQLITE_DELETE = 'DELETE FROM %s WHERE rowid IN ({ids})' % TABLE
+SQLITE_MATCH = '''
+SELECT rowid FROM {table} WHERE {table} MATCH %s
+ORDER BY bm25({table}, 2.0, 1.0), rowid LIMIT %s OFFSET %s
+'''.format(table=TABLE)
+SQLITE_LIKE = '''
+SELECT rowid FROM {table} WHERE title LIKE %s ESCAPE '\\' OR category LIKE %s ESCAPE '\\'
+ORDER BY title, rowid LIMIT %s OFFSET %s
+'''.format(table=TABLE)
+
+POSTGRESQL_UPSERT = '''
+INSERT INTO %s (menuitem_id, title, category) %s
+ON CONFLICT (menuitem_id) DO UPDATE SET title = excluded.title, category = excluded.category
+''' % (TABLE, SOURCE)
+POSTGRESQL_DELETE = 'DELETE FROM %s WHERE menuitem_id IN ({ids})' % TABLE
+POSTGRESQL_MATCH = '''
+SELECT menuitem_id FROM {table}, websearch_to_tsquery('simple', %s) query
+WHERE document @@ query OR %s <%% (title || ' ' || category)
+ORDER BY ts_rank(document, query) + word_similarity(%s, title || ' ' || category) DESC, menuitem_id
+LIMIT %s OFFSET %s
+'''.format(table=TABLE)
+
+
+def backend():
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 34, 0):
+        return 'sqlite'
+    return None
+
+
+def index_items(ids=None, category_id=None):
+    # (Re)indexes the given menu items, or every item in a category, with one
+    # upsert; with neither, the whole menu.
+    vendor = backend()
+    if vendor is None:
+        return
+    where, params = '', []
+    if ids is not None:
+        params = list(ids)
+        if not params:
+            return
+        where = 'WHERE m.id IN (%s)' % ', '.join(['%s'] * len(params))
+    elif category_id is not None:
+        where, params = 'WHERE m.category_id = %s', [category_id]
+    sql = SQLITE_UPSERT if vendor == 'sqlite' else POSTGRESQL_UPSERT
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(where=where), params)
+
+
+def unindex_items(ids):
+    vendor = backend()
+    ids = list(ids)
+    if vendor is None or not ids:
+        return
+    sql = SQLITE_DELETE if vendor == 'sqlite' else POSTGRESQL_DELETE
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(ids=', '.join(['%s'] * len(ids))), ids)
+
+
+def rebuild_index():
+    if backend() is None:
+        return
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % TABLE)
+        index_items()
+
+
+def trigrams(query):
+    grams = {}
+    for word in re.findall(r'\w+', query.lower()):
+        for i in range(len(word) - 2):
+            grams[word[i:i + 3]] = None
+    return list(grams)
+
+
+def search_menu(query, limit, offset=0):
+    # Menu item ids matching query, best first.
+    vendor = backend()
+    if vendor == 'postgresql':
+        sql, params = POSTGRESQL_MATCH, [query, query, query]
+    elif vendor == 'sqlite':
+        grams = trigrams(query)
+        if grams:
+            sql, params = SQLITE_MATCH, [' OR '.join('"%s"' % gram for gram in grams)]
+        else:
+            # Too short for a trigram to match, so scan with LIKE instead.
+            pattern = '%' + re.sub(r'([\\%_])', r'\\\1', query) + '%'
+            sql, params = SQLITE_LIKE, [pattern, pattern]
+    else:
+        items = (MenuItem.objects.filter(Q(title__icontains=query) | Q(category__title__icontains=query))
+                 .order_by('title', 'id').values_list('id', flat=True))
+        return list(items[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit, offset])
+        return [row[0] for row in cursor.fetchall()]
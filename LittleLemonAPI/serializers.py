@@ -1,7 +1,11 @@
+from decimal import Decimal
 from rest_framework import serializers
 from .models import MenuItem, Category, Cart, Order, OrderItem
 from django.contrib.auth.models import User
 
+# The largest primary key a 64-bit id column holds.
+MAX_ID = 2 ** 63 - 1
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
@@ -15,7 +19,9 @@ class MenuItemSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         category_data = validated_data.pop('category')
-        category = Category.objects.create(**category_data)
+        category = Category.objects.filter(slug=category_data['slug']).first()
+        if category is None:
+            category = Category.objects.create(**category_data)
         menu_item = MenuItem.objects.create(category=category, **validated_data)
         return menu_item
     
@@ -27,6 +33,26 @@ class MenuItemSerializer(serializers.ModelSerializer):
             category_serializer.save()
         return super().update(instance, validated_data)
     
+class MenuItemImportSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=255)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=0)
+    featured = serializers.BooleanField(default=False)
+    category_slug = serializers.SlugField()
+    category_title = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    
+class MenuPriceChangeSerializer(serializers.Serializer):
+    percent = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=-100, max_value=1000, required=False)
+    amount = serializers.DecimalField(max_digits=6, decimal_places=2, required=False)
+    category = serializers.SlugField(required=False)
+    menuitems = serializers.ListField(child=serializers.IntegerField(min_value=1, max_value=MAX_ID), max_length=1000, required=False)
+
+    def validate(self, data):
+        if ('percent' in data) == ('amount' in data):
+            raise serializers.ValidationError('Give either percent or amount')
+        if ('category' in data) == ('menuitems' in data):
+            raise serializers.ValidationError('Give either category or menuitems')
+        return data
+    
 class StaffSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -37,12 +63,90 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ['user', 'menuitem', 'quantity', 'unit_price', 'price']
 
+class CartItemInputSerializer(serializers.Serializer):
+    menuitem = serializers.JSONField()
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
+
+    def validate_menuitem(self, value):
+        if isinstance(value, dict):
+            value = value.get('id')
+        # Form data sends ids as strings. bool is an int and int() truncates
+        # floats, so both would otherwise name an item nobody asked for.
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        if isinstance(value, int) and not isinstance(value, bool) and 1 <= value <= MAX_ID:
+            return value
+        raise serializers.ValidationError('Expected a menu item id')
+
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['user', 'delivery_crew', 'status', 'total', 'date']
 
+class MenuItemListSerializer(serializers.BaseSerializer):
+    # Read-only MenuItemSerializer output built directly from the instance,
+    # skipping the per-field machinery on large lists.
+    cents = Decimal('0.01')
+
+    def to_representation(self, instance):
+        category = instance.category
+        return {
+            'id': instance.id,
+            'title': instance.title,
+            'price': str(instance.price.quantize(self.cents)),
+            'featured': instance.featured,
+            'category': {'id': category.id, 'slug': category.slug, 'title': category.title},
+        }
+
+class OrderListSerializer(serializers.BaseSerializer):
+    # Read-only OrderSerializer output.
+    cents = Decimal('0.01')
+
+    def to_representation(self, instance):
+        return {
+            'user': instance.user_id,
+            'delivery_crew': instance.delivery_crew_id,
+            'status': instance.status,
+            'total': str(instance.total.quantize(self.cents)),
+            'date': instance.date.isoformat(),
+        }
+
+class OrderDetailSerializer(OrderListSerializer):
+    # An order with its lines and their menu items nested, read from
+    # orderitem_set prefetched with select_related('menuitem__category').
+
+    def to_representation(self, instance):
+        menuitems = MenuItemListSerializer()
+        return {
+            'id': instance.id,
+            **super().to_representation(instance),
+            'items': [{
+                'menuitem': menuitems.to_representation(item.menuitem),
+                'quantity': item.quantity,
+                'unit_price': str(item.unit_price.quantize(self.cents)),
+                'price': str(item.price.quantize(self.cents)),
+            } for item in instance.orderitem_set.all()],
+        }
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ['order', 'menuitem', 'quantity', 'unit_price', 'price']
+
+
+class DailySalesSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    orders = serializers.IntegerField()
+    items = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+class TopMenuItemSerializer(serializers.Serializer):
+    menuitem = serializers.IntegerField(source='menuitem_id')
+    title = serializers.CharField(source='menuitem__title')
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+class CrewOrdersSerializer(serializers.Serializer):
+    delivery_crew = serializers.IntegerField(source='delivery_crew_id')
+    username = serializers.CharField(source='delivery_crew__username')
+    orders = serializers.IntegerField()
@@ -0,0 +1,90 @@
+from datetime import date
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from .models import Cart, MenuItem, Order, OrderItem
+from .events import ORDER_CREATED, publish_order
+from .reports import sales_job_key
+from .tasks import enqueue
+
+# Django's ORM can't express ON CONFLICT ... DO UPDATE with expressions, so
+# the increment is written in SQL understood by both SQLite (3.24+) and
+# PostgreSQL. Prices are read from the menu inside the same statement. Rows
+# whose quantity or price would outgrow their columns are left alone, which
+# add_to_cart reports as CartLimitExceeded.
+CART_UPSERT_SQL = '''
+INSERT INTO {cart} (user_id, menuitem_id, quantity, unit_price, price)
+SELECT %s, m.id, v.quantity, m.price, m.price * v.quantity
+FROM {menuitem} m JOIN ({values}) v ON v.menuitem_id = m.id
+WHERE v.quantity <= {max_quantity} AND m.price * v.quantity <= {max_price}
+ON CONFLICT (menuitem_id, user_id) DO UPDATE SET
+    quantity = {cart}.quantity + excluded.quantity,
+    unit_price = excluded.unit_price,
+    price = ({cart}.quantity + excluded.quantity) * excluded.unit_price
+WHERE {cart}.quantity + excluded.quantity <= {max_quantity}
+    AND ({cart}.quantity + excluded.quantity) * excluded.unit_price <= {max_price}
+'''
+MAX_QUANTITY = 32767  # Cart.quantity is a SmallIntegerField
+MAX_PRICE = Decimal('9999.99')  # Cart.price and Order.total hold 6 digits
+CART_UPSERT_VALUES = 'SELECT CAST(%s AS INTEGER) AS menuitem_id, CAST(%s AS INTEGER) AS quantity'
+
+
+class CartItemNotFound(Exception):
+    pass
+
+
+class CartLimitExceeded(Exception):
+    pass
+
+
+def add_to_cart(user, items):
+    # items maps menu item ids to quantities. All rows are written by one
+    # upsert statement, so concurrent adds of the same item can't lose updates.
+    if not items:
+        return 0
+    quote = connection.ops.quote_name
+    sql = CART_UPSERT_SQL.format(
+        cart=quote(Cart._meta.db_table),
+        menuitem=quote(MenuItem._meta.db_table),
+        values=' UNION ALL '.join([CART_UPSERT_VALUES] * len(items)),
+        max_quantity=MAX_QUANTITY,
+        max_price=MAX_PRICE,
+    )
+    params = [user.pk]
+    for menuitem_id, quantity in items.items():
+        params += [menuitem_id, quantity]
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            if cursor.rowcount != len(items):
+                if MenuItem.objects.filter(pk__in=items).count() != len(items):
+                    raise CartItemNotFound()
+                raise CartLimitExceeded()
+    return len(items)
+
+
+def checkout(user):
+    # Turns the user's cart into an order with a fixed number of queries:
+    # lock the cart rows, total them in SQL, insert the order and all of its
+    # items in one batch, then delete exactly the rows that were ordered.
+    with transaction.atomic():
+        rows = list(Cart.objects.select_for_update().filter(user=user)
+                    .values('id', 'menuitem_id', 'quantity', 'unit_price', 'price'))
+        if not rows:
+            return None
+        cart = Cart.objects.filter(pk__in=[row.pop('id') for row in rows])
+        total = cart.aggregate(total=Sum('price'))['total']
+        if total > MAX_PRICE:
+            raise CartLimitExceeded()
+
+        order = Order.objects.create(user=user, status=False, total=total, date=date.today())
+        OrderItem.objects.bulk_create([OrderItem(order=order, **row) for row in rows])
+        cart.delete()
+        # Rollups are updated by a job; the payload carries everything it
+        # needs, so it doesn't matter if the order is gone by the time it runs.
+        enqueue('record_sales', {'date': order.date, 'total': total, 'lines': rows}, key=sales_job_key(order.pk))
+        publish_order(ORDER_CREATED, order)
+    return order
@@ -0,0 +1,81 @@
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_token, forget_users
+from .cache import bump_catalogue_version
+from .models import Category, MenuItem
+from .roles import forget_groups, invalidate_roles
+from .search import index_items, unindex_items
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalogue_changed(sender, **kwargs):
+    # Bump after commit so a concurrent read can't cache pre-commit rows
+    # under the new version.
+    transaction.on_commit(bump_catalogue_version)
+
+
+@receiver(post_delete, sender=MenuItem)
+def menu_item_deleted(sender, instance, **kwargs):
+    Category.objects.filter(pk=instance.category_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=MenuItem)
+def menu_item_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'title', 'category'} & set(update_fields):
+        index_items([instance.pk])
+
+
+@receiver(post_delete, sender=MenuItem)
+def menu_item_unindexed(sender, instance, **kwargs):
+    unindex_items([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or 'title' in update_fields):
+        index_items(category_id=instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_roles([instance.pk])
+        forget_users([instance.pk])
+    elif pk_set:
+        invalidate_roles(pk_set)
+        forget_users(pk_set)
+    else:
+        invalidate_roles()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, **kwargs):
+    forget_groups()
+    invalidate_roles()
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    invalidate_roles([instance.pk])
+    forget_users([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    forget_users([instance.pk])
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    forget_token(instance.key)
@@ -0,0 +1,121 @@
+import json
+import logging
+import traceback
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Job
+from .reports import forget_sales, record_sales, sales_job_key
+
+logger = logging.getLogger(__name__)
+
+# A small database-backed job queue for work that doesn't have to finish
+# before the response is sent. enqueue() inserts the job in the caller's
+# transaction, so it exists exactly when the change that caused it commits;
+# `manage.py run_jobs` claims and runs queued jobs, retrying failures with
+# exponential backoff. Jobs given a key are enqueued at most once.
+#
+# With JOBS_EAGER set, enqueue() runs the job immediately instead, which is
+# handy for local development.
+
+registry = {}
+
+
+def task(name=None, max_attempts=3):
+    def register(function):
+        registry[name or function.__name__] = (function, max_attempts)
+        return function
+    return register
+
+
+def enqueue(name, payload=None, key=None, delay=None):
+    function, max_attempts = registry[name]
+    if settings.JOBS_EAGER:
+        # Round-trip the payload so jobs see what the worker would give them.
+        function(json.loads(json.dumps(payload or {}, cls=DjangoJSONEncoder)))
+        return
+    run_after = timezone.now() + delay if delay else timezone.now()
+    Job.objects.bulk_create([Job(name=name, payload=payload or {}, key=key, max_attempts=max_attempts, run_after=run_after)],
+                            ignore_conflicts=True)
+
+
+def requeue_stale():
+    # Jobs left running by a worker that died. The claim counted as an
+    # attempt, so a job that keeps killing its worker fails once it has used
+    # them all instead of coming back forever.
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, updated_at__lt=now - timedelta(seconds=settings.JOBS_TIMEOUT_SECONDS))
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, last_error='Worker stopped while running the job', updated_at=now)
+    return stale.filter(attempts__lt=F('max_attempts')).update(status=Job.QUEUED, updated_at=now)
+
+
+def claim(batch_size):
+    # Marks up to batch_size due jobs as running. The conditional update lets
+    # any number of workers poll the same table without running a job twice.
+    now = timezone.now()
+    claimed = []
+    candidates = (Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+                  .order_by('run_after', 'id').values_list('id', flat=True)[:batch_size])
+    for job_id in list(candidates):
+        if Job.objects.filter(pk=job_id, status=Job.QUEUED).update(
+                status=Job.RUNNING, attempts=F('attempts') + 1, updated_at=now):
+            claimed.append(job_id)
+    return list(Job.objects.filter(pk__in=claimed).order_by('run_after', 'id'))
+
+
+def run(job):
+    function, _ = registry[job.name]
+    try:
+        with transaction.atomic():
+            function(job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) failed on attempt %d\n%s', job.pk, job.name, job.attempts, error)
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, last_error=error, updated_at=timezone.now())
+        else:
+            delay = timedelta(seconds=settings.JOBS_RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1))
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, last_error=error, run_after=timezone.now() + delay, updated_at=timezone.now())
+        return False
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, updated_at=timezone.now())
+    return True
+
+
+def run_pending(batch_size=100):
+    # Runs every due job, returning (succeeded, failed) counts.
+    succeeded = failed = 0
+    requeue_stale()
+    while True:
+        jobs = claim(batch_size)
+        if not jobs:
+            return succeeded, failed
+        for job in jobs:
+            if run(job):
+                succeeded += 1
+            else:
+                failed += 1
+
+
+@task('record_sales', max_attempts=5)
+def record_sales_job(payload):
+    lines = [dict(line, price=Decimal(line['price'])) for line in payload['lines']]
+    record_sales(parse_date(payload['date']), Decimal(payload['total']), lines)
+
+
+@task('forget_sales', max_attempts=10)
+def forget_sales_job(payload):
+    # Queued by forget_order while the order's record_sales job was running;
+    # retried until that job has finished.
+    if Job.objects.filter(key=sales_job_key(payload['order']), status__in=[Job.QUEUED, Job.RUNNING]).exists():
+        raise RuntimeError('record_sales for order %s has not finished' % payload['order'])
+    lines = [dict(line, price=Decimal(line['price'])) for line in payload['lines']]
+    forget_sales(parse_date(payload['date']), Decimal(payload['total']), lines)
@@ -1,3 +1,1855 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache, caches
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, connections, router
+from django.db.models import Count, F
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from LittleLemon import metrics
+from LittleLemon.routers import ReplicaRoutingMiddleware
+
+from . import async_views, views
+from .assignment import assign_orders, unassigned_orders
+from .authentication import HeaderAuthentication
+from .events import CREW_ASSIGNED, ORDER_CREATED, get_broker, order_event
+from .catalogue import change_prices, import_menu, read_rows
+from .filters import filter_orders
+from .cache import CatalogueCacheMixin, menu_cache
+from .models import Cart, CatalogueVersion, Category, DailyCrewOrders, DailyMenuItemSales, DailySales, Job, MenuItem, Order, OrderItem, ThrottleCounter
+from .reports import forget_order, rebuild
+from .roles import DELIVERY_CREW, MANAGER, aget_roles, forget_groups, get_group, get_roles, is_delivery_crew, is_manager
+from .pagination import OrderPagination
+from .renderers import FastJSONRenderer, msgpack
+from .serializers import MenuItemListSerializer, MenuItemSerializer, OrderListSerializer, OrderSerializer
+from .search import rebuild_index, search_menu
+from .services import CartItemNotFound, add_to_cart, checkout
+from .tasks import enqueue, registry, run_pending
+from .throttling import DatabaseCounterStore
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {
+        'anon': '100/minute', 'user': '100/minute', 'menu': '100/minute', 'checkout': '100/minute', **rates}})
+
+
+# For tests that aren't about throttling: no scope has a rate, so throttles
+# let every request through without counting it.
+unthrottled = throttle_rates(anon=None, user=None, menu=None, checkout=None)
+
+
+@unthrottled
+class MenuItemListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mains = Category.objects.create(slug='mains', title='Mains')
+        desserts = Category.objects.create(slug='desserts', title='Desserts')
+        cls.items = MenuItem.objects.bulk_create([
+            MenuItem(title='Item %02d' % i, price=Decimal(i % 7), featured=i % 2 == 0, category=cls.mains if i % 3 else desserts)
+            for i in range(45)
+        ])
+        cls.customer = User.objects.create_user('customer')
+
+    def setUp(self):
+        menu_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def pages(self, url):
+        pages = []
+        while url:
+            pages.append(self.client.get(url).json())
+            url = pages[-1]['next']
+        return pages
+
+    def test_pages_cover_every_item_once_in_order(self):
+        pages = self.pages('/api/menu-items?page_size=10')
+
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 10, 10, 5])
+        ids = [item['id'] for page in pages for item in page['results']]
+        self.assertEqual(ids, [item.pk for item in sorted(self.items, key=lambda item: (item.price, item.pk))])
+
+    def test_previous_link_returns_the_page_before(self):
+        first = self.client.get('/api/menu-items?page_size=10').json()
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_filters_and_ordering(self):
+        pages = self.pages('/api/menu-items?page_size=4&category=mains&featured=true&price_min=2&ordering=-title')
+
+        titles = [item['title'] for page in pages for item in page['results']]
+        expected = sorted((item.title for item in self.items
+                           if item.category_id == self.mains.pk and item.featured and item.price >= 2), reverse=True)
+        self.assertEqual(titles, expected)
+
+    def test_a_page_costs_the_version_lookup_and_one_query(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get('/api/menu-items?page_size=10&category=mains').status_code, 200)
+
+    def test_invalid_parameters_are_rejected(self):
+        for query in ('ordering=bad', 'price_min=abc', 'price_min=NaN', 'price_max=Infinity', 'price_min=-inf', 'featured=maybe'):
+            with self.subTest(query):
+                self.assertEqual(self.client.get('/api/menu-items?' + query).status_code, 400)
+        self.assertEqual(self.client.get('/api/menu-items?cursor=zzz').status_code, 404)
+
+    def test_cursor_values_must_be_strings(self):
+        for values in (['5', {'a': 1}], ['5', 3], ['5', None], ['5', ['1']], ['abc', 'def']):
+            cursor = base64.urlsafe_b64encode(json.dumps({'v': values}).encode()).decode()
+            with self.subTest(values):
+                self.assertEqual(self.client.get('/api/menu-items', {'cursor': cursor}).status_code, 404)
+
+
+@unthrottled
+class CatalogueCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.item = MenuItem.objects.create(title='Soup', price=Decimal('4.25'), featured=False, category=category)
+        cls.customer = User.objects.create_user('customer')
+
+    def setUp(self):
+        menu_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_repeated_reads_only_look_up_the_version(self):
+        for url in ('/api/menu-items', '/api/menu-items/%d' % self.item.pk):
+            first = self.client.get(url)
+            with self.assertNumQueries(1):
+                second = self.client.get(url)
+            self.assertEqual(second.content, first.content)
+
+    def test_writes_invalidate_on_commit(self):
+        self.client.get('/api/menu-items/%d' % self.item.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.title = 'Broth'
+            self.item.save()
+
+        self.assertEqual(self.client.get('/api/menu-items/%d' % self.item.pk).json()['title'], 'Broth')
+
+    def test_version_bumped_elsewhere_is_seen(self):
+        # Another worker's write reaches this one only through the database.
+        self.client.get('/api/menu-items')
+        MenuItem.objects.filter(pk=self.item.pk).update(title='Broth')
+        CatalogueVersion.objects.update(version=F('version') + 1)
+
+        self.assertEqual(self.client.get('/api/menu-items').json()['results'][0]['title'], 'Broth')
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'menu.example.com'])
+    def test_links_follow_the_host_and_scheme_of_the_request(self):
+        MenuItem.objects.create(title='Stew', price=Decimal('6.50'), featured=False, category=self.item.category)
+        for _ in range(2):
+            for host, secure in (('testserver', False), ('menu.example.com', False), ('menu.example.com', True)):
+                response = self.client.get('/api/menu-items', {'page_size': 1}, HTTP_HOST=host, secure=secure)
+                scheme = 'https' if secure else 'http'
+                self.assertTrue(response.json()['next'].startswith('%s://%s/api/menu-items?' % (scheme, host)), response.json())
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.client.get('/api/menu-items/0').status_code, 404)
+        MenuItem.objects.filter(pk=self.item.pk).update(id=0)
+
+        self.assertEqual(self.client.get('/api/menu-items/0').status_code, 200)
+
+
+@unthrottled
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.item = MenuItem.objects.create(title='Soup', price=Decimal('4.25'), featured=False, category=category)
+        cls.customer = User.objects.create_user('customer')
+        cls.orders = Order.objects.bulk_create([
+            Order(user=cls.customer, total=Decimal('5.00'), date=date.today() - timedelta(days=i)) for i in range(3)
+        ])
+
+    def setUp(self):
+        menu_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_menu_validators(self):
+        for url in ('/api/menu-items', '/api/menu-items/%d' % self.item.pk):
+            first = self.client.get(url)
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+            self.assertEqual(self.client.get(url, HTTP_IF_MATCH='"stale"').status_code, 412)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.delete()
+        self.assertEqual(self.client.get('/api/menu-items', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_order_validators_come_from_the_page(self):
+        first = self.client.get('/api/orders?page_size=2')
+        self.assertFalse(first.has_header('Last-Modified'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/orders?page_size=2', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertFalse([q['sql'] for q in queries if 'COUNT(' in q['sql'] or 'MAX(' in q['sql']])
+        self.assertEqual(self.client.get('/api/orders?page_size=2', HTTP_IF_MATCH=first['ETag']).status_code, 200)
+        self.assertEqual(self.client.get('/api/orders?page_size=2', HTTP_IF_MATCH='"stale"').status_code, 412)
+
+        # Changing a row on the page, or the rows after it, changes the ETag.
+        self.orders[0].save()
+        self.assertEqual(self.client.get('/api/orders?page_size=2', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+        second = self.client.get('/api/orders?page_size=2')
+        self.orders[2].delete()
+        self.assertEqual(self.client.get('/api/orders?page_size=2', HTTP_IF_NONE_MATCH=second['ETag']).status_code, 200)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.items = MenuItem.objects.bulk_create([
+            MenuItem(title='Item %d' % i, price=Decimal('2.50'), featured=False, category=category)
+            for i in range(50)
+        ])
+
+    def fill_cart(self, user, count):
+        Cart.objects.bulk_create([
+            Cart(user=user, menuitem=item, quantity=2, unit_price=item.price, price=item.price * 2)
+            for item in self.items[:count]
+        ])
+
+    def test_checkout_moves_cart_into_order(self):
+        user = User.objects.create_user('customer')
+        self.fill_cart(user, 3)
+
+        order = checkout(user)
+
+        self.assertEqual(order.total, Decimal('15.00'))
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertFalse(Cart.objects.filter(user=user).exists())
+
+    def test_empty_cart_creates_nothing(self):
+        user = User.objects.create_user('customer')
+
+        self.assertIsNone(checkout(user))
+        self.assertFalse(Order.objects.exists())
+
+    def test_query_count_is_independent_of_cart_size(self):
+        counts = []
+        for size in (1, 10, 50):
+            user = User.objects.create_user('customer%d' % size)
+            self.fill_cart(user, size)
+            with CaptureQueriesContext(connection) as queries:
+                checkout(user)
+            counts.append(len(queries))
+
+        self.assertEqual(len(set(counts)), 1, counts)
+
+
+@unthrottled
+class OrderDetailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.items = MenuItem.objects.bulk_create([
+            MenuItem(title='Item %d' % i, price=Decimal('2.50'), featured=False, category=category)
+            for i in range(5)
+        ])
+        cls.customer = User.objects.create_user('customer')
+        cls.orders = []
+        for size in (1, 3, 5):
+            add_to_cart(cls.customer, {item.pk: 2 for item in cls.items[:size]})
+            cls.orders.append(checkout(cls.customer))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_detail_nests_lines_and_menu_items(self):
+        order = self.orders[1]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/orders/%d' % order.pk)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 2, [q['sql'] for q in queries])
+        self.assertEqual((response.data['id'], response.data['total']), (order.pk, '15.00'))
+        self.assertEqual(response.data['items'][0], {
+            'menuitem': MenuItemListSerializer(self.items[0]).data,
+            'quantity': 2, 'unit_price': '2.50', 'price': '5.00',
+        })
+        self.assertEqual(len(response.data['items']), 3)
+
+    def test_missing_order_is_not_found(self):
+        self.assertEqual(self.client.get('/api/orders/0').status_code, 404)
+
+    def test_anonymous_callers_cannot_probe_order_ids(self):
+        self.client.force_authenticate(None)
+        for method in ('get', 'patch', 'put', 'delete'):
+            with self.assertNumQueries(0):
+                statuses = [getattr(self.client, method)('/api/orders/%d' % pk).status_code for pk in (self.orders[0].pk, 0)]
+            self.assertEqual(statuses, [401, 401], method)
+
+    def test_other_customers_are_forbidden(self):
+        self.client.force_authenticate(User.objects.create_user('other'))
+
+        self.assertEqual(self.client.get('/api/orders/%d' % self.orders[0].pk).status_code, 403)
+
+    def test_list_with_items_costs_a_fixed_number_of_queries(self):
+        self.client.get('/api/orders?items=true')
+        counts = []
+        for page_size in (1, 3):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/orders?items=true&page_size=%d' % page_size)
+            counts.append(len(queries))
+            self.assertEqual(len(response.data['results']), page_size)
+
+        self.assertEqual(len(set(counts)), 1, counts)
+        self.assertEqual([len(order['items']) for order in response.data['results']], [5, 3, 1])
+
+
+@unthrottled
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager')
+        cls.manager.groups.add(get_group(MANAGER))
+        cls.crew = User.objects.create_user('crew')
+        get_group(DELIVERY_CREW).user_set.add(cls.crew)
+        cls.customer, cls.other = User.objects.create_user('customer'), User.objects.create_user('other')
+        cls.today = date.today()
+        # Two orders a day for five days, so pages split rows that share a
+        # date. List rows carry no id, so each gets its own total.
+        Order.objects.bulk_create([
+            Order(user=cls.customer if n % 2 else cls.other, delivery_crew=cls.crew if n % 3 == 0 else None,
+                  status=n % 4 == 0, total=Decimal(n + 1), date=cls.today - timedelta(days=n // 2))
+            for n in range(10)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.login(self.manager)
+
+    def login(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % AccessToken.for_user(user))
+
+    def expected(self, **filters):
+        return OrderListSerializer(Order.objects.filter(**filters).order_by('-date', '-id'), many=True).data
+
+    def walk(self, url):
+        ids, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            ids += page['results']
+            pages.append(page)
+            url = page['next']
+        return ids, pages
+
+    def test_pages_run_newest_first_in_both_directions(self):
+        ids, pages = self.walk('/api/orders?page_size=3')
+
+        self.assertEqual(ids, self.expected())
+        self.assertEqual(len(pages), 4)
+        self.assertIsNone(pages[0]['previous'])
+        back = []
+        url = pages[-1]['previous']
+        while url:
+            page = self.client.get(url).json()
+            back = page['results'] + back
+            url = page['previous']
+        self.assertEqual(back, ids[:9])
+
+    def test_filters_narrow_every_page(self):
+        since = self.today - timedelta(days=3)
+        until = self.today - timedelta(days=1)
+        ids, _ = self.walk('/api/orders?page_size=2&status=false&date_from=%s&date_to=%s' % (since, until))
+
+        self.assertEqual(ids, self.expected(status=False, date__gte=since, date__lte=until))
+        self.assertTrue(ids)
+
+    def test_history_is_scoped_to_the_caller(self):
+        self.login(self.crew)
+        self.assertEqual(self.walk('/api/orders')[0], self.expected(delivery_crew=self.crew))
+        self.login(self.customer)
+        self.assertEqual(self.walk('/api/orders?status=true')[0], self.expected(user=self.customer, status=True))
+
+    def test_bad_parameters_are_rejected(self):
+        self.assertEqual(self.client.get('/api/orders?date_from=2024-13-01').status_code, 400)
+        self.assertEqual(self.client.get('/api/orders?status=maybe').status_code, 400)
+        self.assertEqual(self.client.get('/api/orders?cursor=not-a-cursor').status_code, 404)
+        cursor = base64.urlsafe_b64encode(json.dumps({'v': [str(self.today), {'a': 1}]}).encode()).decode()
+        self.assertEqual(self.client.get('/api/orders', {'cursor': cursor}).status_code, 404)
+
+    def test_export_streams_every_matching_order(self):
+        response = self.client.get('/api/orders?export=ndjson&status=false')
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], [order.pk for order in Order.objects.filter(status=False).order_by('-date', '-id')])
+        self.assertEqual(set(rows[0]), {'id', 'user', 'delivery_crew', 'status', 'total', 'date'})
+
+        self.login(self.other)
+        response = self.client.get('/api/orders?export=ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual({row['user'] for row in rows}, {self.other.pk})
+        self.assertEqual(len(rows), 5)
+
+
+@unthrottled
+class MenuSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mains = Category.objects.create(slug='mains', title='Mains')
+        cls.desserts = Category.objects.create(slug='desserts', title='Desserts')
+        cls.pizza = MenuItem.objects.create(title='Margherita Pizza', price=Decimal('9.00'), featured=False, category=cls.mains)
+        cls.salad = MenuItem.objects.create(title='Greek Salad', price=Decimal('7.00'), featured=False, category=cls.mains)
+        cls.cake = MenuItem.objects.create(title='Lemon Cake', price=Decimal('5.00'), featured=False, category=cls.desserts)
+        cls.customer = User.objects.create_user('customer')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def titles(self, query):
+        return [MenuItem.objects.get(pk=pk).title for pk in search_menu(query, 10)]
+
+    def test_typos_still_rank_the_right_item_first(self):
+        self.assertEqual(self.titles('margarita')[0], 'Margherita Pizza')
+        self.assertEqual(self.titles('salat')[0], 'Greek Salad')
+        self.assertEqual(self.titles('desert'), ['Lemon Cake'])
+
+    def test_short_queries_match_substrings(self):
+        self.assertEqual(self.titles('sa'), ['Greek Salad'])
+
+    def test_index_follows_writes(self):
+        self.cake.title = 'Lemon Tart'
+        self.cake.save()
+        self.desserts.title = 'Sweets'
+        self.desserts.save()
+        self.salad.delete()
+        import_menu([{'title': 'Tiramisu', 'price': '6.00', 'category_slug': 'desserts'}])
+
+        self.assertEqual(self.titles('tart'), ['Lemon Tart'])
+        self.assertCountEqual(self.titles('sweets'), ['Lemon Tart', 'Tiramisu'])
+        self.assertEqual(self.titles('salad'), [])
+        self.assertEqual(self.titles('tiramisu'), ['Tiramisu'])
+
+    def test_rebuild_restores_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM "LittleLemonAPI_menusearch"')
+        self.assertEqual(self.titles('cake'), [])
+
+        rebuild_index()
+
+        self.assertEqual(self.titles('cake'), ['Lemon Cake'])
+
+    def test_endpoint_pages_ranked_results(self):
+        response = self.client.get('/api/menu-items/search?q=mains&page_size=1')
+
+        self.assertEqual(response.status_code, 200)
+        first = response.json()
+        self.assertEqual(len(first['results']), 1)
+        self.assertIn('page=2', first['next'])
+        second = self.client.get(first['next']).json()
+        self.assertEqual({second['results'][0]['id'], first['results'][0]['id']}, {self.pizza.pk, self.salad.pk})
+        self.assertIsNone(second['next'])
+        self.assertEqual(self.client.get('/api/menu-items/search').status_code, 400)
+
+
+@unthrottled
+class MenuImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mains = Category.objects.create(slug='mains', title='Mains')
+        cls.soup = MenuItem.objects.create(title='Soup', price=Decimal('4.00'), featured=False, category=cls.mains)
+        cls.manager = User.objects.create_user('manager')
+        cls.manager.groups.add(get_group(MANAGER))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def post(self, body, content_type):
+        return self.client.generic('POST', '/api/menu-items/import', body, content_type=content_type)
+
+    def test_jsonl_reports_bad_lines_as_invalid_rows(self):
+        body = b'\n'.join([
+            b'{"title": "Soup", "price": "4.50", "category_slug": "mains"}',
+            b'{"title": "Tart", "price": "5.00", "category_slug": "desserts", "category_title": "Desserts"}',
+            b'{"title": "Stew", "price": "-1", "category_slug": "mains"}',
+            b'{"title": "Pie",',
+            b'{"title": "Cr\xe8pe", "price": "3.00", "category_slug": "desserts"}',
+            b'',
+            b'{"title": "Flan", "price": "3.50", "category_slug": "desserts"}',
+        ])
+        response = self.post(body, 'application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['invalid']), (2, 1, 3))
+        self.assertEqual([error['row'] for error in response.data['errors']], [3, 4, 5])
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.assertEqual(response.data['errors'][1]['errors'], {'non_field_errors': ['Line 4 is not valid JSON']})
+        self.assertEqual(response.data['errors'][2]['errors'], {'non_field_errors': ['Line 5 is not valid UTF-8']})
+        self.assertEqual(MenuItem.objects.get(title='Soup').price, Decimal('4.50'))
+
+    def test_csv_reports_undecodable_rows(self):
+        body = (b'title,price,featured,category_slug\r\n'
+                b'"Caf\xe9\r\nau lait",2.00,false,drinks\r\n'
+                b'Tea,1.50,true,drinks\r\n')
+        response = self.post(body, 'text/csv')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['invalid']), (1, 1))
+        self.assertEqual(response.data['errors'], [{'row': 1, 'errors': {'non_field_errors': ['Line 3 is not valid UTF-8']}}])
+        self.assertTrue(MenuItem.objects.get(title='Tea').featured)
+
+    def test_bad_lines_after_a_written_chunk_are_reported(self):
+        rows = read_rows(['{"title": "Tart", "price": "5.00", "category_slug": "mains"}', 'not json'], 'jsonl')
+        result = import_menu(rows, chunk_size=1)
+
+        self.assertEqual((result['created'], result['invalid']), (1, 1))
+        self.assertEqual(result['errors'][0]['row'], 2)
+
+    def test_only_managers_can_import(self):
+        self.client.force_authenticate(User.objects.create_user('customer'))
+        response = self.post(b'{"title": "Tart", "price": "5.00", "category_slug": "mains"}', 'application/x-ndjson')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(MenuItem.objects.filter(title='Tart').exists())
+
+
+@unthrottled
+class PriceChangeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.mains = Category.objects.create(slug='mains', title='Mains')
+        desserts = Category.objects.create(slug='desserts', title='Desserts')
+        cls.soup = MenuItem.objects.create(title='Soup', price=Decimal('4.25'), featured=False, category=cls.mains)
+        cls.salad = MenuItem.objects.create(title='Salad', price=Decimal('6.00'), featured=False, category=cls.mains)
+        cls.cake = MenuItem.objects.create(title='Cake', price=Decimal('5.00'), featured=False, category=desserts)
+        cls.customers = User.objects.bulk_create([User(username='customer%d' % i) for i in range(20)])
+        for user in cls.customers:
+            add_to_cart(user, {cls.soup.pk: 2, cls.cake.pk: 1})
+        cls.manager = User.objects.create_user('manager')
+        cls.manager.groups.add(get_group(MANAGER))
+
+    def cart_row(self, item):
+        return Cart.objects.filter(menuitem=item).values_list('unit_price', 'price').first()
+
+    def test_percent_change_reprices_carts_in_the_category(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(change_prices(MenuItem.objects.filter(category=self.mains), percent=Decimal('10')), (2, 20))
+
+        self.assertEqual(MenuItem.objects.get(pk=self.soup.pk).price, Decimal('4.68'))
+        self.assertEqual(MenuItem.objects.get(pk=self.salad.pk).price, Decimal('6.60'))
+        self.assertEqual(self.cart_row(self.soup), (Decimal('4.68'), Decimal('9.36')))
+        self.assertEqual(self.cart_row(self.cake), (Decimal('5.00'), Decimal('5.00')))
+        self.assertEqual(len(callbacks), 1)
+
+    def test_amount_change_never_goes_below_zero(self):
+        change_prices(MenuItem.objects.filter(pk__in=[self.soup.pk, self.cake.pk]), amount=Decimal('-4.50'))
+
+        self.assertEqual(MenuItem.objects.get(pk=self.soup.pk).price, Decimal('0'))
+        self.assertEqual(self.cart_row(self.cake), (Decimal('0.50'), Decimal('0.50')))
+
+    def test_query_count_is_independent_of_cart_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            change_prices(MenuItem.objects.filter(pk=self.salad.pk), percent=Decimal('5'))
+        with CaptureQueriesContext(connection) as more_queries:
+            change_prices(MenuItem.objects.all(), percent=Decimal('5'))
+
+        self.assertEqual(len(queries), len(more_queries))
+
+    def test_endpoint_and_single_item_edits_reprice_carts(self):
+        client = APIClient()
+        client.force_authenticate(self.manager)
+        response = client.post('/api/menu-items/prices', {'category': 'mains', 'amount': '1.00'}, format='json')
+        invalid = client.post('/api/menu-items/prices', {'category': 'mains', 'amount': '1', 'percent': '1'}, format='json')
+        client.patch('/api/menu-items/%d' % self.cake.pk, {'price': '7.25'}, format='json')
+
+        self.assertEqual((response.status_code, response.data['menuitems'], response.data['carts']), (200, 2, 20))
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual(self.cart_row(self.soup), (Decimal('5.25'), Decimal('10.50')))
+        self.assertEqual(self.cart_row(self.cake), (Decimal('7.25'), Decimal('7.25')))
+
+    def test_menu_item_ids_must_fit_an_id_column(self):
+        client = APIClient()
+        client.force_authenticate(self.manager)
+        for menuitem in (99999999999999999999999, 2 ** 63, 0):
+            response = client.post('/api/menu-items/prices', {'percent': '10', 'menuitems': [self.soup.pk, menuitem]}, format='json')
+            self.assertEqual(response.status_code, 400, menuitem)
+            self.assertIn('menuitems', response.data)
+        self.assertEqual(MenuItem.objects.get(pk=self.soup.pk).price, Decimal('4.25'))
+
+
+class AddToCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.soup = MenuItem.objects.create(title='Soup', price=Decimal('4.25'), featured=False, category=category)
+        cls.salad = MenuItem.objects.create(title='Salad', price=Decimal('6.00'), featured=False, category=category)
+        cls.user = User.objects.create_user('customer')
+
+    def test_repeated_adds_increment_quantity_and_price(self):
+        add_to_cart(self.user, {self.soup.pk: 1})
+        with CaptureQueriesContext(connection) as queries:
+            add_to_cart(self.user, {self.soup.pk: 2, self.salad.pk: 1})
+
+        statements = [q['sql'] for q in queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 1, statements)
+
+        soup = Cart.objects.get(user=self.user, menuitem=self.soup)
+        self.assertEqual((soup.quantity, soup.unit_price, soup.price), (3, Decimal('4.25'), Decimal('12.75')))
+        self.assertEqual(Cart.objects.get(user=self.user, menuitem=self.salad).quantity, 1)
+
+    def test_unknown_item_rolls_back_the_batch(self):
+        with self.assertRaises(CartItemNotFound):
+            add_to_cart(self.user, {self.soup.pk: 1, 0: 1})
+
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    @unthrottled
+    def test_menu_item_must_be_an_id(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for menuitem in (True, float(self.soup.pk), '%d.5' % self.soup.pk, None, [self.soup.pk], {'id': False},
+                         0, -1, 2 ** 63, 99999999999999999999999, '99999999999999999999999'):
+            response = client.post('/api/cart/menu-items', {'menuitem': menuitem, 'quantity': 1}, format='json')
+            self.assertEqual(response.status_code, 400, menuitem)
+            self.assertIn('menuitem', response.data)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+        for menuitem in (self.soup.pk, str(self.salad.pk), {'id': self.soup.pk}):
+            response = client.post('/api/cart/menu-items', {'menuitem': menuitem, 'quantity': 1}, format='json')
+            self.assertEqual(response.status_code, 200, menuitem)
+        self.assertEqual(Cart.objects.get(user=self.user, menuitem=self.soup).quantity, 2)
+
+    @unthrottled
+    def test_carts_stay_within_their_columns(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        add = lambda quantity: client.post('/api/cart/menu-items', {'menuitem': self.soup.pk, 'quantity': quantity}, format='json')
+
+        self.assertEqual(add(2000).status_code, 200)
+        # 4000 x 4.25 is more than Cart.price holds.
+        self.assertEqual(add(2000).status_code, 400)
+        self.assertEqual(Cart.objects.get(user=self.user, menuitem=self.soup).quantity, 2000)
+        response = client.post('/api/cart/menu-items/batch', [{'menuitem': self.salad.pk, 'quantity': 32767},
+                                                               {'menuitem': self.soup.pk, 'quantity': 1}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(client.get('/api/cart/menu-items').status_code, 200)
+
+        # Each line fits but the order total wouldn't.
+        self.assertEqual(add(350).status_code, 200)
+        self.assertEqual(client.post('/api/cart/menu-items', {'menuitem': self.salad.pk, 'quantity': 1600}, format='json').status_code, 200)
+        self.assertEqual(client.post('/api/orders').status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 2)
+
+@override_settings(ROLE_CACHE_TIMEOUT=60)
+class RoleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('staff')
+
+    def setUp(self):
+        cache.clear()
+        get_group(MANAGER)
+        get_group(DELIVERY_CREW)
+
+    def fresh(self):
+        # A new instance, as the next request would load.
+        return User.objects.get(pk=self.user.pk)
+
+    @override_settings(ROLE_CACHE_TIMEOUT=0)
+    def test_roles_are_memoized_per_request(self):
+        user = self.fresh()
+        with self.assertNumQueries(1):
+            self.assertEqual((is_manager(user), is_delivery_crew(user), get_roles(user)), (False, False, frozenset()))
+        user = self.fresh()
+        with self.assertNumQueries(1):
+            get_roles(user)
+
+    def test_roles_are_cached_across_requests(self):
+        get_roles(self.fresh())
+        user = self.fresh()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_roles(user), frozenset())
+        self.assertEqual(async_to_sync(aget_roles)(self.fresh()), frozenset())
+
+    def test_membership_changes_invalidate_the_cache(self):
+        get_roles(self.fresh())
+        self.user.groups.add(get_group(MANAGER))
+        self.assertTrue(is_manager(self.fresh()))
+
+        get_group(DELIVERY_CREW).user_set.add(self.user)
+        self.assertEqual(get_roles(self.fresh()), frozenset([MANAGER, DELIVERY_CREW]))
+
+        get_group(MANAGER).user_set.remove(self.user)
+        self.assertEqual(async_to_sync(aget_roles)(self.fresh()), frozenset([DELIVERY_CREW]))
+
+        get_group(DELIVERY_CREW).user_set.clear()
+        self.assertEqual(get_roles(self.fresh()), frozenset())
+
+    def test_renaming_a_group_invalidates_every_user(self):
+        self.user.groups.add(get_group(MANAGER))
+        self.assertTrue(is_manager(self.fresh()))
+
+        group = get_group(MANAGER)
+        group.name = 'Former managers'
+        group.save()
+
+        self.assertFalse(is_manager(self.fresh()))
+
+@unthrottled
+class StaffGroupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager')
+        cls.manager.groups.add(get_group(MANAGER))
+        cls.driver = User.objects.create_user('driver')
+
+    def setUp(self):
+        forget_groups()
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def test_groups_are_resolved_once_per_process(self):
+        self.assertEqual(Group.objects.filter(name__in=[MANAGER, DELIVERY_CREW]).count(), 2)
+        with self.assertNumQueries(1):
+            group = get_group(DELIVERY_CREW)
+        with self.assertNumQueries(0):
+            self.assertIs(get_group(DELIVERY_CREW), group)
+
+    def test_deleted_groups_are_recreated(self):
+        old_pk = get_group(DELIVERY_CREW).pk
+        get_group(DELIVERY_CREW).delete()
+
+        group = get_group(DELIVERY_CREW)
+        self.assertNotEqual(group.pk, old_pk)
+        self.assertTrue(Group.objects.filter(pk=group.pk, name=DELIVERY_CREW).exists())
+
+    def test_managers_add_and_list_delivery_crew(self):
+        response = self.client.post('/api/groups/delivery-crew/users', {'username': 'driver'})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/groups/delivery-crew/users', {'username': 'new-driver'})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get('/api/groups/delivery-crew/users')
+        self.assertEqual(sorted(user['username'] for user in response.data), ['driver', 'new-driver'])
+        self.assertEqual([user['username'] for user in self.client.get('/api/groups/manager/users').data], ['manager'])
+
+        self.client.force_authenticate(self.driver)
+        self.assertEqual(self.client.get('/api/groups/delivery-crew/users').status_code, 403)
+
+class ReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.soup = MenuItem.objects.create(title='Soup', price=Decimal('4.25'), featured=False, category=category)
+        cls.salad = MenuItem.objects.create(title='Salad', price=Decimal('6.00'), featured=False, category=category)
+
+    def place_order(self, username, items):
+        user = User.objects.create_user(username)
+        add_to_cart(user, items)
+        return checkout(user)
+
+    def snapshot(self):
+        return (
+            list(DailySales.objects.order_by('date').values_list('date', 'orders', 'items', 'revenue')),
+            list(DailyMenuItemSales.objects.order_by('menuitem').values_list('menuitem', 'quantity', 'revenue')),
+        )
+
+    def test_checkout_updates_rollups_like_a_rebuild(self):
+        self.place_order('first', {self.soup.pk: 2})
+        self.place_order('second', {self.soup.pk: 1, self.salad.pk: 3})
+        self.assertEqual(run_pending(), (2, 0))
+
+        incremental = self.snapshot()
+        rebuild()
+
+        self.assertEqual(incremental, self.snapshot())
+        self.assertEqual(incremental[0][0][1:], (2, 6, Decimal('30.75')))
+
+    @unthrottled
+    def test_orders_deleted_before_their_job_runs_never_count(self):
+        kept = self.place_order('first', {self.soup.pk: 2})
+        deleted = self.place_order('second', {self.soup.pk: 1, self.salad.pk: 3})
+        manager = User.objects.create_user('manager')
+        manager.groups.add(get_group(MANAGER))
+        client = APIClient()
+        client.force_authenticate(manager)
+
+        self.assertEqual(client.delete('/api/orders/%d' % deleted.pk).status_code, 200)
+        self.assertEqual(run_pending(), (1, 0))
+        incremental = self.snapshot()
+        rebuild()
+        self.assertEqual(incremental, self.snapshot())
+        self.assertEqual(incremental[0][0][1:], (1, 2, kept.total))
+
+    def test_orders_deleted_while_their_job_runs_are_subtracted_after_it(self):
+        order = self.place_order('first', {self.soup.pk: 2})
+        Job.objects.update(status=Job.RUNNING)
+        forget_order(order)
+        order.delete()
+
+        Job.objects.update(run_after=timezone.now())
+        with self.assertLogs('LittleLemonAPI.tasks', 'WARNING'):
+            # forget_sales waits for record_sales to finish.
+            self.assertEqual(run_pending(), (0, 1))
+        Job.objects.filter(name='record_sales').update(status=Job.QUEUED)
+        Job.objects.update(run_after=timezone.now())
+        self.assertEqual(run_pending(), (2, 0))
+        self.assertEqual(self.snapshot()[0][0][1:], (0, 0, Decimal('0.00')))
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_jobs_run_inside_checkout(self):
+        self.place_order('first', {self.soup.pk: 2})
+
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(DailySales.objects.get().revenue, Decimal('8.50'))
+
+    @override_settings(JOBS_EAGER=True)
+    @unthrottled
+    def test_top_menu_items_limit(self):
+        self.place_order('first', {self.soup.pk: 2, self.salad.pk: 1})
+        manager = User.objects.create_user('manager')
+        manager.groups.add(get_group(MANAGER))
+        client = APIClient()
+        client.force_authenticate(manager)
+
+        response = client.get('/api/reports/top-menu-items', {'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['menuitem'] for row in response.data], [self.soup.pk])
+        self.assertEqual(len(client.get('/api/reports/top-menu-items').data), 2)
+        for limit in ('-5', '0', '101', 'ten', '1.5'):
+            response = client.get('/api/reports/top-menu-items', {'limit': limit})
+            self.assertEqual(response.status_code, 400, limit)
+            self.assertIn('limit', response.data)
+
+
+@unthrottled
+class AssignmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.busy, cls.idle, cls.away = [User.objects.create_user(name) for name in ('busy', 'idle', 'away')]
+        cls.away.is_active = False
+        cls.away.save()
+        get_group(DELIVERY_CREW).user_set.add(cls.busy, cls.idle, cls.away)
+        cls.customer = User.objects.create_user('customer')
+        cls.today = date.today()
+        # Delivered orders don't count towards a crew member's load.
+        cls.place(3, delivery_crew=cls.busy)
+        cls.place(4, delivery_crew=cls.idle, status=True)
+
+    @classmethod
+    def place(cls, count, **fields):
+        Order.objects.bulk_create([Order(user=cls.customer, total=Decimal('5.00'), date=cls.today, **fields) for _ in range(count)])
+
+    def open_loads(self):
+        return dict(Order.objects.filter(status=False).values_list('delivery_crew').annotate(Count('id')).order_by())
+
+    def test_orders_go_to_the_least_loaded_active_crew(self):
+        self.place(7)
+
+        self.assertEqual(assign_orders(), {self.idle.pk: 5, self.busy.pk: 2})
+        self.assertEqual(self.open_loads(), {self.busy.pk: 5, self.idle.pk: 5})
+
+    def test_limit_leaves_the_rest_unassigned(self):
+        self.place(7)
+
+        self.assertEqual(assign_orders(limit=2, batch_size=1), {self.idle.pk: 2})
+        self.assertEqual(Order.objects.filter(delivery_crew__isnull=True).count(), 5)
+
+    def test_crew_rollups_match_a_rebuild(self):
+        self.place(7)
+        rebuild()
+        assign_orders(batch_size=3)
+
+        incremental = list(DailyCrewOrders.objects.order_by('delivery_crew').values_list('delivery_crew', 'orders'))
+        rebuild()
+        self.assertEqual(incremental, list(DailyCrewOrders.objects.order_by('delivery_crew').values_list('delivery_crew', 'orders')))
+
+    def test_query_count_is_independent_of_batch_size(self):
+        counts = []
+        for size in (10, 200):
+            self.place(size)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(sum(assign_orders().values()), size)
+            counts.append(len(queries))
+
+        self.assertEqual(len(set(counts)), 1, counts)
+
+    def test_only_managers_can_assign(self):
+        self.place(2)
+        manager = User.objects.create_user('manager')
+        manager.groups.add(get_group(MANAGER))
+        client = APIClient()
+
+        client.force_authenticate(self.customer)
+        self.assertEqual(client.post('/api/orders/assign').status_code, 403)
+        client.force_authenticate(manager)
+        response = client.post('/api/orders/assign', {'limit': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['assigned'], [{'delivery_crew': self.idle.pk, 'orders': 1}])
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        patcher = mock.patch.dict(registry, {'flaky': (self.flaky, 2)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def flaky(self, payload):
+        self.calls.append(payload)
+        if payload.get('fail'):
+            raise ValueError('boom')
+
+    def test_keyed_jobs_run_once(self):
+        for _ in range(3):
+            enqueue('flaky', {'n': 1}, key='flaky:1')
+        enqueue('flaky', {'n': 2})
+
+        self.assertEqual(run_pending(), (2, 0))
+        self.assertEqual(self.calls, [{'n': 1}, {'n': 2}])
+        self.assertEqual(run_pending(), (0, 0))
+
+    @override_settings(JOBS_RETRY_DELAY_SECONDS=0)
+    def test_failing_jobs_are_retried_then_given_up(self):
+        enqueue('flaky', {'fail': True})
+
+        with self.assertLogs('LittleLemonAPI.tasks', 'WARNING'):
+            self.assertEqual(run_pending(), (0, 2))
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn('ValueError: boom', job.last_error)
+
+    @override_settings(JOBS_RETRY_DELAY_SECONDS=0, JOBS_TIMEOUT_SECONDS=60)
+    def test_failed_jobs_are_not_requeued(self):
+        enqueue('flaky', {'fail': True})
+        with self.assertLogs('LittleLemonAPI.tasks', 'WARNING'):
+            run_pending()
+        # Two jobs a dead worker left running, one with attempts to spare.
+        long_ago = timezone.now() - timedelta(minutes=5)
+        Job.objects.bulk_create([Job(name='flaky', status=Job.RUNNING, attempts=attempts, max_attempts=2, updated_at=long_ago)
+                                 for attempts in (1, 2)])
+        Job.objects.update(updated_at=long_ago)
+
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(sorted(Job.objects.values_list('attempts', 'status')),
+                         [(2, Job.DONE), (2, Job.FAILED), (2, Job.FAILED)])
+        self.assertEqual(run_pending(), (0, 0))
+        self.assertEqual(len(self.calls), 3)
+
+    def test_worker_refreshes_connections_each_poll(self):
+        enqueue('flaky', {})
+        with mock.patch('LittleLemonAPI.management.commands.run_jobs.close_old_connections') as close:
+            call_command('run_jobs', once=True, stdout=StringIO())
+
+        close.assert_called_once_with()
+        self.assertEqual(self.calls, [{}])
+
+    def test_delayed_jobs_wait(self):
+        enqueue('flaky', {}, delay=timedelta(minutes=5))
+
+        self.assertEqual(run_pending(), (0, 0))
+        Job.objects.update(run_after=timezone.now())
+        self.assertEqual(run_pending(), (1, 0))
+
+
+class RendererTests(TestCase):
+    def test_fast_renderer_matches_json_renderer(self):
+        data = {'price': Decimal('2.50'), 'when': timezone.now(), 'day': date.today(), 1: 'one',
+                'text': 'caf\u00e9 \u2028', 'nested': [{'ok': True, 'none': None}]}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    @unthrottled
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_menu_items_negotiate_msgpack(self):
+        category = Category.objects.create(slug='mains', title='Mains')
+        item = MenuItem.objects.create(title='Soup', price=Decimal('4.5'), featured=True, category=category)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('customer'))
+        menu_cache().clear()
+
+        for url in ('/api/menu-items', '/api/menu-items/%d' % item.pk):
+            # The second request is served from CatalogueCacheMixin's cache.
+            first = client.get(url, HTTP_ACCEPT='application/msgpack')
+            with self.assertNumQueries(1):
+                second = client.get(url, HTTP_ACCEPT='application/msgpack')
+            expected = client.get(url, HTTP_ACCEPT='application/json').json()
+            for response in (first, second):
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'application/msgpack')
+                self.assertEqual(msgpack.unpackb(response.content), expected)
+
+    def test_list_serializers_match_model_serializers(self):
+        category = Category.objects.create(slug='mains', title='Mains')
+        MenuItem.objects.create(title='Soup', price=Decimal('4.5'), featured=True, category=category)
+        user = User.objects.create_user('customer')
+        Order.objects.create(user=user, total=Decimal('12'), date=date.today())
+
+        items = MenuItem.objects.select_related('category')
+        self.assertEqual(MenuItemListSerializer(items, many=True).data, MenuItemSerializer(items, many=True).data)
+        orders = Order.objects.all()
+        self.assertEqual(OrderListSerializer(orders, many=True).data, OrderSerializer(orders, many=True).data)
+
+
+@unthrottled
+@override_settings(METRICS_ENABLED=True, METRICS_SLOW_REQUEST_SECONDS=None)
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(slug='mains', title='Mains')
+        MenuItem.objects.create(title='Soup', price=Decimal('4.00'), featured=False, category=category)
+        cls.admin = User.objects.create_user('admin', is_staff=True)
+
+    def setUp(self):
+        metrics.registry.clear()
+        # The middleware list is read when a client makes its first request.
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_histograms_are_served_in_the_prometheus_format(self):
+        self.client.get('/api/menu-items', {'format': 'api'})
+        self.client.get('/api/menu-items', {'format': 'api'})
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        labels = 'route="api/menu-items",method="GET"'
+        for name in metrics.METRICS:
+            self.assertIn('# TYPE %s histogram' % name, lines)
+            self.assertIn('%s_count{%s} 2' % (name, labels), lines)
+            self.assertIn('%s_bucket{%s,le="+Inf"} 2' % (name, labels), lines)
+        self.assertIn('# HELP littlelemon_render_seconds Time spent rendering the response body after the view returns', lines)
+        buckets = [int(line.rsplit(' ', 1)[1]) for line in lines if line.startswith('littlelemon_db_queries_bucket{%s' % labels)]
+        self.assertEqual(buckets, sorted(buckets))
+
+    def test_serialization_is_timed_apart_from_rendering(self):
+        # The second request is a catalogue cache hit and serializes nothing.
+        self.client.get('/api/menu-items')
+        self.client.get('/api/menu-items')
+        lines = self.client.get('/metrics').content.decode().splitlines()
+
+        labels = 'route="api/menu-items",method="GET"'
+        self.assertIn('littlelemon_request_seconds_count{%s} 2' % labels, lines)
+        self.assertIn('littlelemon_serialize_seconds_count{%s} 1' % labels, lines)
+        total = next(line for line in lines if line.startswith('littlelemon_serialize_seconds_sum{%s}' % labels))
+        self.assertGreater(float(total.rsplit(' ', 1)[1]), 0)
+
+    def test_only_staff_can_read_metrics(self):
+        self.client.force_authenticate(User.objects.create_user('customer'))
+
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs('LittleLemon.metrics', 'WARNING') as logs:
+            self.client.get('/api/menu-items')
+
+        self.assertIn('Slow request GET /api/menu-items (api/menu-items) -> 200', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+@unthrottled
+class AsyncReadTests(TestCase):
+    # The async read views are only routed when ASYNC_READ_ROUTES is set, so
+    # they are called directly here and compared with the DRF views.
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager')
+        cls.manager.groups.add(get_group(MANAGER))
+        cls.customer = User.objects.create_user('customer')
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.item = MenuItem.objects.create(title='Soup', price=Decimal('4.25'), featured=True, category=category)
+        MenuItem.objects.create(title='Stew', price=Decimal('6.50'), featured=False, category=category)
+        Order.objects.create(user=cls.customer, total=Decimal('4.25'), date=date.today())
+        Order.objects.create(user=cls.manager, total=Decimal('6.50'), date=date.today())
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def headers(self, user):
+        return {'Authorization': 'Bearer %s' % AccessToken.for_user(user)}
+
+    def get_async(self, view, path, headers=None, **kwargs):
+        return async_to_sync(view)(AsyncRequestFactory().get(path, headers=headers), **kwargs)
+
+    def assertMatchesSync(self, view, user, path, **kwargs):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.headers(user)['Authorization'])
+        expected = client.get(path)
+        response = self.get_async(view, path, self.headers(user), **kwargs)
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(json.loads(response.content), expected.json())
+        self.assertEqual(response['ETag'], expected['ETag'])
+
+        headers = dict(self.headers(user), **{'If-None-Match': response['ETag']})
+        self.assertEqual(self.get_async(view, path, headers, **kwargs).status_code, 304)
+
+    def test_menu_items(self):
+        self.assertMatchesSync(async_views.menu_items, self.customer, '/api/menu-items?price_min=5')
+
+    def test_menu_item(self):
+        self.assertMatchesSync(async_views.menu_item, self.customer, '/api/menu-items/%d' % self.item.pk, pk=self.item.pk)
+
+    def test_orders(self):
+        for user in (self.customer, self.manager):
+            self.assertMatchesSync(async_views.orders, user, '/api/orders')
+
+    def test_anonymous_users_are_refused(self):
+        for view, path, kwargs in (
+            (async_views.menu_items, '/api/menu-items', {}),
+            (async_views.menu_item, '/api/menu-items/%d' % self.item.pk, {'pk': self.item.pk}),
+            (async_views.orders, '/api/orders', {}),
+        ):
+            response = self.get_async(view, path, **kwargs)
+            self.assertEqual(response.status_code, 401, path)
+            self.assertIn('WWW-Authenticate', response)
+
+
+@unthrottled
+class OrderEventTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager')
+        cls.manager.groups.add(get_group(MANAGER))
+        cls.crew = User.objects.create_user('crew')
+        cls.other_crew = User.objects.create_user('other-crew')
+        get_group(DELIVERY_CREW).user_set.add(cls.crew, cls.other_crew)
+        cls.customer = User.objects.create_user('customer')
+        cls.order = Order.objects.create(user=cls.customer, delivery_crew=cls.other_crew, total=Decimal('5.00'), date=date.today())
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.item = MenuItem.objects.create(title='Soup', price=Decimal('5.00'), featured=False, category=category)
+
+    async def open_feed(self, user):
+        request = AsyncRequestFactory().get('/api/orders/events', headers={'Authorization': 'Bearer %s' % AccessToken.for_user(user)})
+        response = await async_views.order_events(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        feed = response.streaming_content
+        self.assertTrue((await anext(feed)).startswith(b'retry:'))
+        return feed
+
+    async def next_event(self, feed):
+        chunk = (await asyncio.wait_for(anext(feed), 1)).decode()
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+        return fields['event'], json.loads(fields['data'])
+
+    async def test_feeds_only_carry_visible_orders(self):
+        feeds = [await self.open_feed(user) for user in (self.crew, self.customer, self.manager)]
+        crew, customer, manager = feeds
+        try:
+            get_broker().publish(order_event(ORDER_CREATED, self.order))
+            self.order.delivery_crew = self.crew
+            get_broker().publish(order_event(CREW_ASSIGNED, self.order, previous_delivery_crew=self.other_crew.pk))
+
+            self.assertEqual(await self.next_event(crew), (CREW_ASSIGNED, mock.ANY))
+            self.assertEqual([(await self.next_event(customer))[0] for _ in range(2)], [ORDER_CREATED, CREW_ASSIGNED])
+            event, data = await self.next_event(manager)
+            self.assertEqual((event, data['order']['id'], data['order']['user']), (ORDER_CREATED, self.order.pk, self.customer.pk))
+            self.assertEqual((await self.next_event(manager))[0], CREW_ASSIGNED)
+        finally:
+            for feed in feeds:
+                await self.disconnect(feed)
+        self.assertFalse(get_broker().subscribers)
+
+    async def disconnect(self, feed):
+        # What the ASGI handler does when the client goes away: cancel the
+        # task waiting for the next chunk.
+        waiting = asyncio.ensure_future(anext(feed))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+
+    async def test_client_disconnect_ends_the_feed(self):
+        # Through the real ASGI handler, which doesn't know about the test
+        # transaction, so keep it from closing the connection.
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+        messages = asyncio.Queue()
+        await messages.put({'type': 'http.request', 'body': b'', 'more_body': False})
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        token = AccessToken.for_user(self.customer)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': '/api/orders/events', 'raw_path': b'/api/orders/events', 'query_string': b'', 'root_path': '',
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+            'headers': [(b'host', b'testserver'), (b'authorization', b'Bearer %s' % str(token).encode())],
+        }
+        served = asyncio.ensure_future(ASGIHandler()(scope, messages.get, send))
+        for _ in range(100):
+            if get_broker().subscribers:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(len(get_broker().subscribers), 1)
+        self.assertEqual(sent[0]['status'], 200)
+
+        await messages.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(served, 1)
+        self.assertFalse(get_broker().subscribers)
+
+    def test_feed_is_refused_under_wsgi(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer %s' % AccessToken.for_user(self.customer))
+        response = client.get('/api/orders/events')
+
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(get_broker().subscribers)
+
+    def test_changes_publish_after_commit(self):
+        client = APIClient()
+        client.force_authenticate(self.manager)
+        with mock.patch('LittleLemonAPI.events.get_broker') as broker:
+            with self.captureOnCommitCallbacks(execute=True):
+                client.put('/api/orders/%d' % self.order.pk, {'delivery_crew': self.crew.pk})
+                broker.return_value.publish.assert_not_called()
+            add_to_cart(self.customer, {self.item.pk: 1})
+            with self.captureOnCommitCallbacks(execute=True):
+                checkout(self.customer)
+
+        events = [call.args[0] for call in broker.return_value.publish.call_args_list]
+        self.assertEqual([event['type'] for event in events], [CREW_ASSIGNED, ORDER_CREATED])
+        self.assertEqual(events[0]['previous_delivery_crew'], self.other_crew.pk)
+        self.assertEqual(events[0]['order']['delivery_crew'], self.crew.pk)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRoutingTests(SimpleTestCase):
+    # Only checks where reads would go; no database connection is opened.
+    def setUp(self):
+        caches['default'].clear()
+
+    def route(self, method, authorization=None, status_code=200, reads=1):
+        aliases = []
+
+        def view(request):
+            aliases.extend(router.db_for_read(MenuItem) for _ in range(reads))
+            return HttpResponse(status=status_code)
+
+        headers = {'Authorization': authorization} if authorization else {}
+        ReplicaRoutingMiddleware(view)(RequestFactory().generic(method, '/api/menu-items', headers=headers))
+        return aliases
+
+    def test_safe_reads_rotate_over_replicas(self):
+        self.assertEqual(sorted(self.route('GET', reads=4)), ['replica1', 'replica1', 'replica2', 'replica2'])
+        self.assertEqual(self.route('POST'), ['default'])
+        self.assertEqual(router.db_for_read(MenuItem), 'default')
+
+    def test_writers_read_their_writes(self):
+        self.route('POST', 'Bearer customer', status_code=201)
+
+        self.assertEqual(self.route('GET', 'Bearer customer'), ['default'])
+        self.assertNotEqual(self.route('GET', 'Bearer other'), ['default'])
+        self.route('POST', 'Bearer failed', status_code=400)
+        self.assertNotEqual(self.route('GET', 'Bearer failed'), ['default'])
+
+    def test_transactions_and_loaded_instances_stay_put(self):
+        def view(request):
+            with mock.patch.object(connections['default'], 'in_atomic_block', True):
+                inside = router.db_for_read(MenuItem)
+            item = MenuItem(title='Soup')
+            item._state.db = 'default'
+            return HttpResponse(' '.join([inside, router.db_for_read(Category, instance=item)]))
+
+        response = ReplicaRoutingMiddleware(view)(RequestFactory().get('/api/menu-items'))
+        self.assertEqual(response.content, b'default default')
+
+    @mock.patch('LittleLemonAPI.cache.get_catalogue_version', return_value=1)
+    def test_menu_cache_fills_read_from_the_default_database(self, version):
+        # The version comes from the default database, so a payload read
+        # from a lagging replica could be stored under a version it predates.
+        menu_cache().clear()
+        aliases = []
+
+        class View(CatalogueCacheMixin):
+            def get_renderer_context(self):
+                return {}
+
+        def build():
+            aliases.append(router.db_for_read(MenuItem))
+            return Response({'results': []})
+
+        def view(request):
+            request.accepted_renderer, request.accepted_media_type = FastJSONRenderer(), 'application/json'
+            aliases.append(router.db_for_read(MenuItem))
+            return View().cached_response(request, 'list', build)
+
+        for _ in range(2):
+            ReplicaRoutingMiddleware(view)(RequestFactory().get('/api/menu-items'))
+        self.assertEqual([alias.rstrip('12') for alias in aliases], ['replica', 'default', 'replica'])
+
+    async def test_async_menu_cache_fills_read_from_the_default_database(self):
+        menu_cache().clear()
+        aliases = []
+
+        async def build():
+            aliases.append(await sync_to_async(router.db_for_read)(MenuItem))
+            return HttpResponse(b'[]', content_type='application/json')
+
+        async def view(request):
+            await async_views.cached_catalogue(request, 'list', build)
+            aliases.append(router.db_for_read(MenuItem))
+            return HttpResponse()
+
+        request = AsyncRequestFactory().get('/api/menu-items')
+        request.accepted_media_type = 'application/json'
+        with mock.patch('LittleLemonAPI.async_views.catalogue_key', return_value='catalogue:1:list'):
+            await ReplicaRoutingMiddleware(view)(request)
+        self.assertEqual([alias.rstrip('12') for alias in aliases], ['default', 'replica'])
+
+
+@override_settings(AUTH_CACHE_TIMEOUT=30)
+class AuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def authenticate(self, header):
+        request = RequestFactory().get('/api/orders', headers={'Authorization': header})
+        user, _ = HeaderAuthentication().authenticate(request)
+        is_manager(user)
+        return user
+
+    def test_repeated_requests_skip_the_database(self):
+        for header in ('Bearer %s' % AccessToken.for_user(self.user), 'Token %s' % self.token.key):
+            self.authenticate(header)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.authenticate(header), self.user)
+
+    def test_group_and_user_changes_invalidate(self):
+        header = 'Token %s' % self.token.key
+        self.assertFalse(is_manager(self.authenticate(header)))
+        self.user.groups.add(get_group(MANAGER))
+        self.assertTrue(is_manager(self.authenticate(header)))
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(header)
+
+    def test_deleted_token_is_rejected(self):
+        header = 'Token %s' % self.token.key
+        self.authenticate(header)
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(header)
+
+    @override_settings(AUTH_CACHE_TIMEOUT=0)
+    def test_uncached_lookups_see_changes_made_elsewhere(self):
+        # What another process sees: no signal clears its cache.
+        header = 'Token %s' % self.token.key
+        self.authenticate(header)
+        Token.objects.filter(pk=self.token.pk).delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(header)
+
+
+class ThrottleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('customer')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @mock.patch.object(DatabaseCounterStore, 'next_cleanup', float('inf'))
+    def test_counter_slides_between_windows(self):
+        store = DatabaseCounterStore()
+        for _ in range(3):
+            with self.assertNumQueries(1):
+                counts = store.hit('throttle:user:1', 100, 60)
+        self.assertEqual(counts, (0, 3))
+        self.assertEqual(store.hit('throttle:user:1', 101, 60), (3, 1))
+        self.assertEqual(store.hit('throttle:user:1', 103, 60), (0, 1))
+
+    @mock.patch.object(DatabaseCounterStore, 'next_cleanup', 0)
+    def test_expired_counters_are_deleted(self):
+        store = DatabaseCounterStore()
+        period = int(time.time() // 60)
+        store.hit('throttle:user:gone', period - 2, 60)
+        store.hit('throttle:user:previous', period - 1, 60)
+        self.assertEqual(ThrottleCounter.objects.count(), 2)
+
+        DatabaseCounterStore.next_cleanup = 0
+        with self.assertNumQueries(2):
+            store.hit('throttle:user:current', period, 60)
+        self.assertCountEqual(ThrottleCounter.objects.values_list('key', flat=True),
+                              ['throttle:user:previous', 'throttle:user:current'])
+        with self.assertNumQueries(1):
+            store.hit('throttle:user:current', period, 60)
+
+    def test_user_rate_is_read_per_request(self):
+        with throttle_rates(user='3/minute'):
+            statuses = [self.client.get('/api/cart/menu-items').status_code for _ in range(4)]
+            response = self.client.get('/api/cart/menu-items')
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        self.assertTrue(response.has_header('Retry-After'))
+
+    def test_menu_reads_use_their_own_scope(self):
+        with throttle_rates(user='2/minute', menu='5/minute'):
+            menu = [self.client.get('/api/menu-items').status_code for _ in range(6)]
+            cart = [self.client.get('/api/cart/menu-items').status_code for _ in range(2)]
+        self.assertEqual(menu, [200] * 5 + [429])
+        self.assertEqual(cart, [200, 200])
+
+
+@unthrottled
+class ConcurrentCheckoutTests(TransactionTestCase):
+    # Customers fill their carts and check out at the same time from separate
+    # threads, each with its own database connection.
+    shoppers = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a file-backed test database')
+        forget_groups()
+        category = Category.objects.create(slug='mains', title='Mains')
+        self.items = MenuItem.objects.bulk_create([
+            MenuItem(title='Item %d' % i, price=Decimal('2.50'), featured=False, category=category)
+            for i in range(5)
+        ])
+
+    def test_parallel_carts_and_checkouts(self):
+        users = [User.objects.create_user('customer%d' % i) for i in range(self.shoppers)]
+        barrier = threading.Barrier(self.shoppers)
+        failures = []
+
+        def shop(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                responses = [client.post('/api/cart/menu-items', {'menuitem': item.pk, 'quantity': 2}, format='json')
+                             for item in self.items]
+                responses.append(client.post('/api/orders'))
+                responses.append(client.get('/api/orders'))
+                failures.extend((user.username, r.status_code, r.content) for r in responses if r.status_code >= 400)
+            except Exception as exc:
+                failures.append((user.username, exc))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=shop, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(failures, [])
+        self.assertEqual(Order.objects.count(), self.shoppers)
+        self.assertEqual(OrderItem.objects.count(), self.shoppers * len(self.items))
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(run_pending(), (self.shoppers, 0))
+        self.assertEqual(DailySales.objects.get().orders, self.shoppers)
+
+
+class QueryPlanTests(TestCase):
+    # Plan markers for a full table scan and for sorting the matches, per
+    # backend. The planners only prefer an index once the table is big and
+    # analyzed, hence the seeded orders and the ANALYZE below.
+    plans = {
+        'sqlite': (r'\bSCAN\b', r'TEMP B-TREE FOR ORDER BY'),
+        'postgresql': (r'Seq Scan', r'\bSort\b'),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        customers = [User.objects.create_user('customer%d' % i) for i in range(50)]
+        crews = [User.objects.create_user('crew%d' % i) for i in range(20)]
+        cls.customer, cls.crew = customers[0], crews[0]
+        category = Category.objects.create(slug='mains', title='Mains')
+        items = MenuItem.objects.bulk_create([
+            MenuItem(title='Dish %d' % i, price=Decimal('5.00'), featured=False, category=category) for i in range(50)
+        ])
+        # Mostly delivered, assigned and older than a month, so every filter
+        # below picks out a small share of the table.
+        orders = Order.objects.bulk_create([
+            Order(user=customers[i % len(customers)], delivery_crew=crews[i % len(crews)] if i % 50 else None,
+                  status=i % 20 != 0, total=Decimal('5.00'), date=date.today() - timedelta(days=i % 365))
+            for i in range(5000)
+        ])
+        cls.customer_order = orders[0]
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menuitem=items[line], quantity=1, unit_price=Decimal('5.00'), price=Decimal('5.00'))
+            for order in orders for line in range(2)
+        ])
+        Cart.objects.bulk_create([
+            Cart(user=customer, menuitem=item, quantity=1, unit_price=Decimal('5.00'), price=Decimal('5.00'))
+            for customer in customers for item in items[:10]
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_query_plans(self):
+        # The hot order and cart queries must be answered from an index:
+        # no full table scan and, for the paged order lists, no sort.
+        if connection.vendor not in self.plans:
+            self.skipTest('no plan markers for %s' % connection.vendor)
+        full_scan, sort = self.plans[connection.vendor]
+        since = date.today() - timedelta(days=30)
+        queries = {
+            'orders for customer': (OrderPagination.ordering, Order.objects.filter(user=self.customer)),
+            'orders for crew': (OrderPagination.ordering, Order.objects.filter(delivery_crew=self.crew)),
+            'open orders for crew': (OrderPagination.ordering, filter_orders(Order.objects.filter(delivery_crew=self.crew), {'status': 'false'})),
+            'orders by status': (OrderPagination.ordering, filter_orders(Order.objects.all(), {'status': 'false'})),
+            'orders since': (OrderPagination.ordering, filter_orders(Order.objects.all(), {'date_from': str(since)})),
+            'unassigned orders': (None, unassigned_orders()[:500]),
+            'cart for customer': (None, Cart.objects.filter(user=self.customer)),
+            'lines for order': (None, OrderItem.objects.filter(order=self.customer_order)),
+        }
+        for name, (ordering, queryset) in queries.items():
+            if ordering:
+                queryset = queryset.order_by(*ordering)[:OrderPagination.page_size + 1]
+            plan = queryset.explain()
+            with self.subTest(name):
+                self.assertNotRegex(plan, full_scan, plan)
+                if ordering:
+                    self.assertNotRegex(plan, sort, plan)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+# The benchmarks are slow and write results files, so they only run when
+# asked for: BENCHMARK=1 manage.py test LittleLemonAPI --tag benchmark
+benchmark = skipUnless(os.environ.get('BENCHMARK'), 'set BENCHMARK=1 to run the benchmarks')
+
+
+@tag('benchmark')
+@benchmark
+@unthrottled
+class EndpointBenchmarkTests(TestCase):
+    # Drives every route in LittleLemonAPI/urls.py against a large synthetic
+    # dataset. Each request must stay within its query budget, which does not
+    # depend on the amount of data. Latency and throughput go to
+    # BENCHMARK_RESULTS, in the temp directory unless set. When
+    # BENCHMARK_BASELINE points at an earlier results file, any endpoint whose
+    # median latency grew by more than BENCHMARK_TOLERANCE fails.
+    scale = int(os.environ.get('BENCHMARK_SCALE', 1))
+    repeat = int(os.environ.get('BENCHMARK_REPEAT', 5))
+    results_path = os.environ.get('BENCHMARK_RESULTS', os.path.join(tempfile.gettempdir(), 'benchmark_results.json'))
+    baseline_path = os.environ.get('BENCHMARK_BASELINE')
+    tolerance = float(os.environ.get('BENCHMARK_TOLERANCE', 1.5))
+    noise_floor_ms = 2.0
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls.results:
+            with open(cls.results_path, 'w') as output:
+                json.dump({'scale': cls.scale, 'repeat': cls.repeat, 'endpoints': cls.results}, output, indent=2, sort_keys=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager', is_staff=True)
+        cls.manager.groups.add(get_group(MANAGER))
+        cls.crew = User.objects.bulk_create([User(username='crew%d' % i) for i in range(10)])
+        get_group(DELIVERY_CREW).user_set.add(*cls.crew)
+        cls.customers = User.objects.bulk_create([User(username='customer%d' % i) for i in range(200 * cls.scale)])
+        cls.customer = cls.customers[0]
+
+        categories = Category.objects.bulk_create([
+            Category(slug='category-%d' % i, title='Category %d' % i) for i in range(20)
+        ])
+        cls.items = MenuItem.objects.bulk_create([
+            MenuItem(title='Dish %05d' % i, price=Decimal(100 + i % 2000) / 100, featured=i % 10 == 0,
+                     category=categories[i % len(categories)])
+            for i in range(3000 * cls.scale)
+        ])
+
+        Cart.objects.bulk_create([
+            Cart(user=user, menuitem=cls.items[(n * 7 + i) % len(cls.items)], quantity=1,
+                 unit_price=cls.items[(n * 7 + i) % len(cls.items)].price,
+                 price=cls.items[(n * 7 + i) % len(cls.items)].price)
+            for n, user in enumerate(cls.customers[1:]) for i in range(3)
+        ])
+
+        today = date.today()
+        orders = Order.objects.bulk_create([
+            Order(user=cls.customers[i % len(cls.customers)], delivery_crew=cls.crew[i % 10] if i % 3 else None,
+                  status=i % 4 == 0, total=Decimal('10.00'), date=today - timedelta(days=i % 365))
+            for i in range(5000 * cls.scale)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menuitem=cls.items[(n + i) % len(cls.items)], quantity=2,
+                      unit_price=Decimal('2.50'), price=Decimal('5.00'))
+            for n, order in enumerate(orders) for i in range(2)
+        ])
+        cls.customer_order = Order.objects.filter(user=cls.customer).first()
+        rebuild()
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def measure(self, name, user, budget, send, prepare=None):
+        client = self.client_for(user)
+        timings = []
+        for run in range(self.repeat):
+            context = prepare(run) if prepare else run
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = send(client, context)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - start) * 1000)
+            self.assertLess(response.status_code, 400, '%s: %s' % (name, getattr(response, 'data', '')))
+            statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+            self.assertLessEqual(len(statements), budget, '%s ran %d queries:\n%s' % (name, len(statements), '\n'.join(statements)))
+
+        result = {
+            'median_ms': round(percentile(timings, 0.5), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'requests_per_second': round(1000 * len(timings) / sum(timings), 1),
+        }
+        self.results[name] = result
+        self.check_baseline(name, result)
+
+    def check_baseline(self, name, result):
+        if not self.baseline_path:
+            return
+        with open(self.baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)['endpoints'].get(name)
+        if baseline is None:
+            return
+        allowed = max(baseline['median_ms'] * self.tolerance, baseline['median_ms'] + self.noise_floor_ms)
+        self.assertLessEqual(result['median_ms'], allowed, '%s regressed from %.2fms to %.2fms' % (
+            name, baseline['median_ms'], result['median_ms']))
+
+    def new_item_payload(self, run):
+        return {'title': 'New dish %d' % run, 'price': '9.50', 'featured': False,
+                'category': {'slug': 'category-1', 'title': 'Category 1'}}
+
+    def test_menu_items(self):
+        self.measure('GET menu-items', self.customer, 3, lambda c, _: c.get('/api/menu-items'))
+        self.measure('GET menu-items filtered', self.customer, 3,
+                     lambda c, _: c.get('/api/menu-items?category=category-3&price_min=5&ordering=-price&page_size=50'))
+        self.measure('GET menu-items deep page', self.customer, 3,
+                     lambda c, _: c.get('/api/menu-items?cursor=' + self.cursor_after(self.items[-100])))
+        self.measure('POST menu-items', self.manager, 4,
+                     lambda c, run: c.post('/api/menu-items', self.new_item_payload(run), format='json'))
+
+        self.measure('GET menu-items/search', self.customer, 3, lambda c, _: c.get('/api/menu-items/search?q=dish 0042'))
+
+    def cursor_after(self, item):
+        return base64.urlsafe_b64encode(json.dumps({'v': [str(item.price), str(item.pk)]}).encode()).decode()
+
+    def test_single_menu_item(self):
+        item = self.items[len(self.items) // 2]
+        url = '/api/menu-items/%d' % item.pk
+        self.measure('GET menu-items/<pk>', self.customer, 3, lambda c, _: c.get(url))
+        self.measure('PATCH menu-items/<pk>', self.manager, 5, lambda c, run: c.patch(url, {'price': '%d.25' % (run + 1)}, format='json'))
+        self.measure('DELETE menu-items/<pk>', self.manager, 7,
+                     lambda c, pk: c.delete('/api/menu-items/%d' % pk),
+                     prepare=lambda run: self.items[run].pk)
+
+    def test_menu_import_export(self):
+        rows = '\n'.join(json.dumps({'title': 'Dish %05d' % i, 'price': '4.00', 'category_slug': 'category-%d' % (i % 20)})
+                         for i in range(500))
+        self.measure('POST menu-items/import', self.manager, 9,
+                     lambda c, _: c.generic('POST', '/api/menu-items/import', rows, content_type='application/x-ndjson'))
+        self.measure('GET menu-items/export', self.manager, 3 * self.scale + 1, lambda c, _: c.get('/api/menu-items/export'))
+        self.measure('POST menu-items/prices', self.manager, 3,
+                     lambda c, _: c.post('/api/menu-items/prices', {'category': 'category-3', 'percent': '1'}, format='json'))
+
+    def test_staff_groups(self):
+        for offset, (group, name) in enumerate((('manager', MANAGER), ('delivery-crew', DELIVERY_CREW))):
+            url = '/api/groups/%s/users' % group
+            users = self.customers[10 + 20 * offset:30 + 20 * offset]
+            self.measure('GET ' + url, self.manager, 2, lambda c, _: c.get(url))
+            self.measure('POST ' + url, self.manager, 5, lambda c, username: c.post(url, {'username': username}),
+                         prepare=lambda run: users[run].username)
+            self.measure('DELETE %s/<pk>' % url, self.manager, 12, lambda c, pk: c.delete('%s/%d' % (url, pk)),
+                         prepare=lambda run: self.add_to_group(name, users[10 + run]).pk)
+
+    def add_to_group(self, name, user):
+        get_group(name).user_set.add(user)
+        return user
+
+    def test_cart(self):
+        self.measure('GET cart/menu-items', self.customers[1], 2, lambda c, _: c.get('/api/cart/menu-items'))
+        self.measure('POST cart/menu-items', self.customer, 1,
+                     lambda c, run: c.post('/api/cart/menu-items', {'menuitem': self.items[run].pk, 'quantity': 1}, format='json'))
+        batch = [{'menuitem': item.pk, 'quantity': 2} for item in self.items[:50]]
+        self.measure('POST cart/menu-items/batch', self.customer, 1,
+                     lambda c, _: c.post('/api/cart/menu-items/batch', batch, format='json'))
+        self.measure('DELETE cart/menu-items', self.customer, 1, lambda c, _: c.delete('/api/cart/menu-items'))
+
+    def test_orders(self):
+        self.measure('GET orders as customer', self.customer, 3, lambda c, _: c.get('/api/orders'))
+        self.measure('GET orders as crew', self.crew[0], 3, lambda c, _: c.get('/api/orders'))
+        self.measure('GET orders as manager', self.manager, 3, lambda c, _: c.get('/api/orders?date_from=%s' % (date.today() - timedelta(days=30))))
+        self.measure('GET orders with items', self.customer, 5, lambda c, _: c.get('/api/orders?items=true'))
+        self.measure('GET orders export', self.manager, 3 + 3 * self.scale, lambda c, _: c.get('/api/orders?export=ndjson&status=true'))
+        self.measure('POST orders', self.customer, 6, lambda c, _: c.post('/api/orders'),
+                     prepare=lambda run: add_to_cart(self.customer, {item.pk: 1 for item in self.items[:20]}))
+
+    def test_single_order(self):
+        url = '/api/orders/%d' % self.customer_order.pk
+        self.measure('GET orders/<pk>', self.customer, 2, lambda c, _: c.get(url))
+        self.measure('PATCH orders/<pk>', self.crew[0], 3, lambda c, _: c.patch(url))
+        self.measure('PUT orders/<pk>', self.manager, 6, lambda c, run: c.put(url, {'delivery_crew': self.crew[run % 10].pk}))
+        orders = list(Order.objects.filter(user=self.customers[5]).values_list('pk', flat=True)[:self.repeat])
+        self.measure('DELETE orders/<pk>', self.manager, 10, lambda c, pk: c.delete('/api/orders/%d' % pk),
+                     prepare=lambda run: orders[run])
+
+    def test_serializers(self):
+        # Serializing and rendering whole tables, old path against new.
+        cases = (
+            ('menu-items', list(MenuItem.objects.select_related('category')), MenuItemSerializer, MenuItemListSerializer),
+            ('orders', list(Order.objects.all()), OrderSerializer, OrderListSerializer),
+        )
+        for name, rows, serializer, list_serializer in cases:
+            expected = JSONRenderer().render(serializer(rows, many=True).data)
+            for label, serializer_class, renderer in (('DRF', serializer, JSONRenderer()), ('fast', list_serializer, FastJSONRenderer())):
+                timings = []
+                for _ in range(self.repeat):
+                    start = time.perf_counter()
+                    content = renderer.render(serializer_class(rows, many=True).data)
+                    timings.append((time.perf_counter() - start) * 1000)
+                self.assertEqual(content, expected)
+                self.results['serialize %s (%s)' % (name, label)] = {'median_ms': round(percentile(timings, 0.5), 3), 'rows': len(rows)}
+
+    def test_reports(self):
+        since = date.today() - timedelta(days=90)
+        self.measure('GET reports/daily-sales', self.manager, 2, lambda c, _: c.get('/api/reports/daily-sales?date_from=%s' % since))
+        self.measure('GET reports/top-menu-items', self.manager, 2, lambda c, _: c.get('/api/reports/top-menu-items?date_from=%s' % since))
+        self.measure('GET reports/crew-orders', self.manager, 2, lambda c, _: c.get('/api/reports/crew-orders'))
+
+
+@tag('benchmark')
+@benchmark
+@unthrottled
+class AsyncReadBenchmarkTests(TestCase):
+    # Serves the same reads through the DRF views one at a time and through
+    # the async views BENCHMARK_CONCURRENCY at a time. Payloads must match;
+    # timings go to BENCHMARK_ASYNC_RESULTS.
+    concurrency = int(os.environ.get('BENCHMARK_CONCURRENCY', 20))
+    results_path = os.environ.get('BENCHMARK_ASYNC_RESULTS', os.path.join(tempfile.gettempdir(), 'benchmark_async_results.json'))
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls.results:
+            with open(cls.results_path, 'w') as output:
+                json.dump({'concurrency': cls.concurrency, 'endpoints': cls.results}, output, indent=2, sort_keys=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager')
+        cls.manager.groups.add(get_group(MANAGER))
+        cls.crew = User.objects.create_user('crew')
+        cls.crew.groups.add(get_group(DELIVERY_CREW))
+        cls.customer = User.objects.create_user('customer')
+        category = Category.objects.create(slug='mains', title='Mains')
+        cls.items = MenuItem.objects.bulk_create([
+            MenuItem(title='Dish %d' % i, price=Decimal(100 + i) / 100, featured=i % 10 == 0, category=category)
+            for i in range(500)
+        ])
+        Order.objects.bulk_create([
+            Order(user=cls.customer, delivery_crew=cls.crew if i % 2 else None, status=False,
+                  total=Decimal('10.00'), date=date.today() - timedelta(days=i % 30))
+            for i in range(200)
+        ])
+
+    async def compare(self, name, user, sync_view, async_view, path, **kwargs):
+        header = 'Bearer %s' % AccessToken.for_user(user)
+
+        def send_sync():
+            response = sync_view(RequestFactory().get(path, headers={'Authorization': header}), **kwargs)
+            return response.render() if hasattr(response, 'render') else response
+
+        await sync_to_async(self.clear_caches)()
+        start = time.perf_counter()
+        expected = [await sync_to_async(send_sync)() for _ in range(self.concurrency)]
+        sync_ms = (time.perf_counter() - start) * 1000
+
+        await sync_to_async(self.clear_caches)()
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            async_view(AsyncRequestFactory().get(path, headers={'Authorization': header}), **kwargs)
+            for _ in range(self.concurrency)
+        ])
+        async_ms = (time.perf_counter() - start) * 1000
+
+        for response in responses:
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(json.loads(response.content), json.loads(expected[0].content))
+            self.assertEqual(response['ETag'], expected[0]['ETag'])
+        self.results[name] = {'sync_ms': round(sync_ms, 3), 'async_ms': round(async_ms, 3)}
+
+    def clear_caches(self):
+        for cache in caches.all():
+            cache.clear()
+
+    async def test_menu_items(self):
+        await self.compare('GET menu-items', self.customer, views.MenuItemsView.as_view(), async_views.menu_items,
+                           '/api/menu-items?price_min=2&page_size=50')
+
+    async def test_single_menu_item(self):
+        await self.compare('GET menu-items/<pk>', self.customer, views.SingleMenuItemView.as_view(), async_views.menu_item,
+                           '/api/menu-items/%d' % self.items[10].pk, pk=self.items[10].pk)
+
+    async def test_orders(self):
+        for name, user in (('customer', self.customer), ('crew', self.crew), ('manager', self.manager)):
+            await self.compare('GET orders as ' + name, user, views.OrderView.as_view(), async_views.orders,
+                               '/api/orders?page_size=50')
+
+    async def test_unauthenticated(self):
+        response = await async_views.orders(AsyncRequestFactory().get('/api/orders'))
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,133 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from .models import ThrottleCounter
+
+THROTTLE_CACHE = 'throttle'
+CLEANUP_SECONDS = 300
+
+# One row per (scope, client) holding the request counts of the current and
+# previous window. The upsert rolls the windows forward and increments in a
+# single atomic statement (SQLite 3.35+ and PostgreSQL both support RETURNING);
+# the SET expressions all read the row's old values. expires is when the
+# window after next starts, at which point both counts have aged out.
+COUNTER_UPSERT_SQL = '''
+INSERT INTO {table} ({key}, period, hits, previous_hits, expires) VALUES (%s, %s, 1, 0, %s)
+ON CONFLICT ({key}) DO UPDATE SET
+    previous_hits = CASE
+        WHEN {table}.period = excluded.period THEN {table}.previous_hits
+        WHEN {table}.period = excluded.period - 1 THEN {table}.hits
+        ELSE 0 END,
+    hits = CASE WHEN {table}.period = excluded.period THEN {table}.hits + 1 ELSE 1 END,
+    period = excluded.period,
+    expires = excluded.expires
+RETURNING previous_hits, hits
+'''
+
+
+class DatabaseCounterStore:
+    # Clients that stop sending requests leave their row behind, so each
+    # process deletes expired rows at most once every CLEANUP_SECONDS.
+    next_cleanup = 0
+
+    def hit(self, key, period, duration):
+        now = time.time()
+        if now >= DatabaseCounterStore.next_cleanup:
+            DatabaseCounterStore.next_cleanup = now + CLEANUP_SECONDS
+            self.delete_expired(now)
+        quote = connection.ops.quote_name
+        sql = COUNTER_UPSERT_SQL.format(table=quote(ThrottleCounter._meta.db_table), key=quote('key'))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [key, period, (period + 2) * duration])
+            return cursor.fetchone()
+
+    def delete_expired(self, now):
+        return ThrottleCounter.objects.filter(expires__lt=now).delete()[0]
+
+
+class CacheCounterStore:
+    # For a cache with atomic increments (Redis INCR). Each window is its own
+    # key and expires once it can no longer be the previous window.
+    def __init__(self, cache):
+        self.cache = cache
+
+    def hit(self, key, period, duration):
+        current_key = '%s:%d' % (key, period)
+        self.cache.add(current_key, 0, timeout=2 * duration)
+        hits = self.cache.incr(current_key)
+        return self.cache.get('%s:%d' % (key, period - 1), 0), hits
+
+
+def get_store():
+    if THROTTLE_CACHE in settings.CACHES:
+        return CacheCounterStore(caches[THROTTLE_CACHE])
+    return DatabaseCounterStore()
+
+
+class SharedRateThrottle(SimpleRateThrottle):
+    # Sliding-window counter kept in a store shared by every worker process.
+    # The previous window's count is weighted by how much of it still overlaps
+    # the trailing window, so memory per client is fixed at two counters.
+    # Rates are read on each request from DEFAULT_THROTTLE_RATES. A view may
+    # set throttle_scopes, e.g. {'GET': 'menu'}, to count those requests
+    # against a separate scope and rate.
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def __init__(self):
+        pass
+
+    def get_scope(self, request, view):
+        return getattr(view, 'throttle_scopes', {}).get(request.method, self.scope)
+
+    def get_rate(self):
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+        except KeyError:
+            raise ImproperlyConfigured("No default throttle rate set for '%s' scope" % self.scope)
+
+    def allow_request(self, request, view):
+        self.scope = self.get_scope(request, view)
+        self.rate = self.get_rate()
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        period, self.elapsed = divmod(self.now, self.duration)
+        previous_hits, hits = get_store().hit(self.key, int(period), self.duration)
+        self.count = previous_hits * (1 - self.elapsed / self.duration) + hits
+        return self.count <= self.num_requests
+
+    def wait(self):
+        # Time until the current window closes and its count starts to decay.
+        return self.duration - self.elapsed
+
+
+class AnonRateThrottle(SharedRateThrottle):
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class UserRateThrottle(SharedRateThrottle):
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
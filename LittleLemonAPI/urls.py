@@ -1,14 +1,25 @@
 from django.urls import path
-from . import views
+from . import async_views, views
+from .async_views import read_route
 
 urlpatterns = [
-    path('menu-items', views.MenuItemsView.as_view()),
-    path('menu-items/<int:pk>', views.SingleMenuItemView.as_view()),
+    path('menu-items', read_route('menu-items', views.MenuItemsView.as_view(), async_views.menu_items)),
+    path('menu-items/<int:pk>', read_route('menu-item', views.SingleMenuItemView.as_view(), async_views.menu_item)),
+    path('menu-items/import', views.MenuItemImportView.as_view()),
+    path('menu-items/export', views.MenuItemExportView.as_view()),
+    path('menu-items/search', views.MenuItemSearchView.as_view()),
+    path('menu-items/prices', views.MenuPriceChangeView.as_view()),
     path('groups/manager/users', views.ManagersView.as_view()),
     path('groups/manager/users/<int:pk>', views.SingleManagerView.as_view()),
     path('groups/delivery-crew/users', views.DeliveryCrewView.as_view()),
     path('groups/delivery-crew/users/<int:pk>', views.SingleDeliveryCrewMemberView.as_view()),
     path('cart/menu-items', views.CartView.as_view()),
-    path('orders', views.OrderView.as_view()),
+    path('cart/menu-items/batch', views.CartBatchView.as_view()),
+    path('orders', read_route('orders', views.OrderView.as_view(), async_views.orders, sync_params=('export', 'items'))),
+    path('orders/events', async_views.order_events),
+    path('orders/assign', views.OrderAssignView.as_view()),
     path('orders/<int:pk>', views.OrderItemView.as_view()),
+    path('reports/daily-sales', views.DailySalesReportView.as_view()),
+    path('reports/top-menu-items', views.TopMenuItemsReportView.as_view()),
+    path('reports/crew-orders', views.CrewOrdersReportView.as_view()),
 ]
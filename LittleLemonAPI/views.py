@@ -1,22 +1,42 @@
-from django.http import Http404, HttpResponseBadRequest
+import codecs
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, status
-from .models import MenuItem, Cart, Order, OrderItem
-from .serializers import MenuItemSerializer, StaffSerializer, CartSerializer, OrderSerializer, OrderItemSerializer
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.views import APIView
+from .models import MenuItem, Cart, Order, OrderItem, DailySales, DailyMenuItemSales, DailyCrewOrders
+from .serializers import MenuItemSerializer, MenuItemListSerializer, MenuPriceChangeSerializer, StaffSerializer, CartSerializer, CartItemInputSerializer, OrderSerializer, OrderListSerializer, OrderDetailSerializer, OrderItemSerializer, DailySalesSerializer, TopMenuItemSerializer, CrewOrdersSerializer
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from .permissions import IsDeliveryCrew, IsManager
-from django.contrib.auth.models import User, Group
+from .permissions import IsDeliveryCrew, IsManager, IsOrderOwner
+from .roles import DELIVERY_CREW, MANAGER, get_group, is_delivery_crew, is_manager
+from .filters import MenuItemFilter, OrderFilter, filter_report_dates, parse_bool, parse_int
+from .pagination import MenuItemPagination, OrderPagination, SearchPagination
+from .cache import CatalogueCacheMixin, get_catalogue_version
+from .catalogue import FORMATS, change_prices, export_menu, import_menu, read_rows, reprice_carts
+from .reports import crew_orders, daily_sales, forget_order, record_assignment, top_menu_items
+from .assignment import assign_orders
+from .search import search_menu
+from .services import CartItemNotFound, CartLimitExceeded, add_to_cart, checkout
+from .conditional import CatalogueConditionalMixin, PageConditionalMixin
+from .events import CREW_ASSIGNED, STATUS_CHANGED, publish_order
+from django.contrib.auth.models import User
 from rest_framework.mixins import CreateModelMixin
 from rest_framework.response import Response
-from datetime import date
-from rest_framework.throttling import UserRateThrottle, AnonRateThrottle
+from .throttling import UserRateThrottle, AnonRateThrottle
 
 
-class MenuItemsView(generics.ListCreateAPIView):
+class MenuItemsView(CatalogueConditionalMixin, CatalogueCacheMixin, generics.ListCreateAPIView):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
-    queryset = MenuItem.objects.all()
+    queryset = MenuItem.objects.select_related('category')
+    throttle_scopes = {'GET': 'menu', 'HEAD': 'menu'}
     serializer_class = MenuItemSerializer
+    filter_backends = [MenuItemFilter]
+    pagination_class = MenuItemPagination
 
     def get_permissions(self):
         if self.request.method == 'POST':
@@ -28,9 +48,18 @@ class MenuItemsView(generics.ListCreateAPIView):
         
         return [permission() for permission in permission_classes]
 
-class SingleMenuItemView(generics.RetrieveUpdateDestroyAPIView):
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return MenuItemListSerializer
+        return MenuItemSerializer
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, 'list', lambda: super(MenuItemsView, self).list(request, *args, **kwargs))
+
+class SingleMenuItemView(CatalogueConditionalMixin, CatalogueCacheMixin, generics.RetrieveUpdateDestroyAPIView):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
-    queryset = MenuItem.objects.all()
+    throttle_scopes = {'GET': 'menu', 'HEAD': 'menu'}
+    queryset = MenuItem.objects.select_related('category')
     serializer_class = MenuItemSerializer
 
     def get_permissions(self):
@@ -42,13 +71,104 @@ class SingleMenuItemView(generics.RetrieveUpdateDestroyAPIView):
             permission_classes = [IsAuthenticated, IsAdminUser]
         
         return [permission() for permission in permission_classes]
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return MenuItemListSerializer
+        return MenuItemSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, 'detail', lambda: super(SingleMenuItemView, self).retrieve(request, *args, **kwargs), kwargs['pk'])
+
+    def perform_update(self, serializer):
+        price = serializer.instance.price
+        with transaction.atomic():
+            item = serializer.save()
+            if item.price != price:
+                reprice_carts(MenuItem.objects.filter(pk=item.pk))
+
+class MenuPriceChangeView(APIView):
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    def post(self, request, *args, **kwargs):
+        serializer = MenuPriceChangeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if 'category' in data:
+            items = MenuItem.objects.filter(category__slug=data['category'])
+        else:
+            items = MenuItem.objects.filter(pk__in=data['menuitems'])
+        changed, carts = change_prices(items, data.get('percent'), data.get('amount'))
+        return Response({'message': 'Changed %d prices and repriced %d cart rows' % (changed, carts),
+                         'menuitems': changed, 'carts': carts}, status.HTTP_200_OK)
     
+class MenuItemSearchView(CatalogueConditionalMixin, CatalogueCacheMixin, generics.ListAPIView):
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    throttle_scopes = {'GET': 'menu', 'HEAD': 'menu'}
+    permission_classes = [IsAuthenticated]
+    serializer_class = MenuItemListSerializer
+    pagination_class = SearchPagination
+    max_query_length = 100
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, 'search', lambda: self.search(request))
+
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()[:self.max_query_length]
+        if not query:
+            return Response({'message': 'Expected a search term in q'}, status.HTTP_400_BAD_REQUEST)
+        ids = self.paginator.paginate_search(lambda limit, offset: search_menu(query, limit, offset), request)
+        items = MenuItem.objects.select_related('category').in_bulk(ids)
+        results = [items[pk] for pk in ids if pk in items]
+        return self.get_paginated_response(self.get_serializer(results, many=True).data)
+
+class PassthroughContentNegotiation(DefaultContentNegotiation):
+    # For views that build their own response body: accept any Accept header.
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+class MenuItemImportView(APIView):
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    permission_classes = [IsAuthenticated, IsManager]
+    content_types = {
+        'text/csv': 'csv',
+        'application/x-ndjson': 'jsonl',
+        'application/jsonl': 'jsonl',
+        'application/json-lines': 'jsonl',
+    }
+
+    def post(self, request, *args, **kwargs):
+        content_type = request.content_type.split(';')[0].strip().lower()
+        format = request.query_params.get('input') or self.content_types.get(content_type)
+        if format not in FORMATS:
+            return Response({'message': 'Send text/csv or application/x-ndjson'}, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        if request.stream is None:
+            return Response({'message': 'Empty body'}, status.HTTP_400_BAD_REQUEST)
+        result = import_menu(read_rows(codecs.iterdecode(request.stream, 'utf-8', errors='surrogateescape'), format))
+        return Response(result, status.HTTP_200_OK)
+
+class MenuItemExportView(APIView):
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    permission_classes = [IsAuthenticated, IsManager]
+    content_negotiation_class = PassthroughContentNegotiation
+    content_types = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+    def get(self, request, *args, **kwargs):
+        format = request.query_params.get('output', 'jsonl')
+        if format not in FORMATS:
+            return Response({'message': 'Expected output=jsonl or output=csv'}, status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(export_menu(format), content_type=self.content_types[format])
+        response['Content-Disposition'] = 'attachment; filename="menu.%s"' % format
+        return response
+
 class ManagersView(generics.ListAPIView, generics.CreateAPIView):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
-    group = Group.objects.get(name='Manager')
-    queryset = User.objects.filter(groups=group)
     serializer_class = StaffSerializer
 
+    def get_queryset(self):
+        return User.objects.filter(groups=get_group(MANAGER))
+
     def get_permissions(self):
         if self.request.method in ['POST', 'GET']:
             permission_classes = [IsAuthenticated, IsManager]
@@ -68,17 +188,16 @@ class ManagersView(generics.ListAPIView, generics.CreateAPIView):
             except (Http404):
                 super().create(request, *args, **kwargs)
                 user = get_object_or_404(User, username=username)
-            managers = Group.objects.get(name='Manager')
-            managers.user_set.add(user)
-            managers.save()
+            get_group(MANAGER).user_set.add(user)
             return Response({'message':'Successfully added user to Manager group'}, status.HTTP_201_CREATED)
     
 class DeliveryCrewView(generics.ListCreateAPIView):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
-    group = Group.objects.get(name='Delivery Crew')
-    queryset = User.objects.filter(groups=group)
     serializer_class = StaffSerializer
 
+    def get_queryset(self):
+        return User.objects.filter(groups=get_group(DELIVERY_CREW))
+
     def get_permissions(self):
         if self.request.method in ['POST', 'GET']:
             permission_classes = [IsAuthenticated, IsManager]
@@ -98,17 +217,16 @@ class DeliveryCrewView(generics.ListCreateAPIView):
             except (Http404):
                 super().create(request, *args, **kwargs)
                 user = get_object_or_404(User, username=username)
-            delivery_crew = Group.objects.get(name='Delivery Crew')
-            delivery_crew.user_set.add(user)
-            delivery_crew.save()
+            get_group(DELIVERY_CREW).user_set.add(user)
             return Response({'message':'Successfully added user to Delivery Crew group'}, status.HTTP_201_CREATED)
 
 class SingleManagerView(generics.DestroyAPIView):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
-    group = Group.objects.get(name='Manager')
-    queryset = User.objects.filter(groups=group)
     serializer_class = StaffSerializer
 
+    def get_queryset(self):
+        return User.objects.filter(groups=get_group(MANAGER))
+
     def get_permissions(self):
         if self.request.method == 'DELETE':
             permission_classes = [IsAuthenticated, IsManager]
@@ -123,10 +241,11 @@ class SingleManagerView(generics.DestroyAPIView):
     
 class SingleDeliveryCrewMemberView(generics.DestroyAPIView):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
-    group = Group.objects.get(name='Delivery Crew')
-    queryset = User.objects.filter(groups=group)
     serializer_class = StaffSerializer
 
+    def get_queryset(self):
+        return User.objects.filter(groups=get_group(DELIVERY_CREW))
+
     def get_permissions(self):
         if self.request.method == 'DELETE':
             permission_classes = [IsAuthenticated, IsManager]
@@ -149,22 +268,15 @@ class CartView(generics.ListCreateAPIView, generics.DestroyAPIView):
         return Cart.objects.filter(user=user)
     
     def create(self, request, *args, **kwargs):
-        request_item = request.data['menuitem']
-        menuitem = MenuItem.objects.get(pk=request_item['id'])
-        quantity = (int) (request.data['quantity'])
-        unit_price = menuitem.price
-        price = quantity * unit_price
-
-        if not menuitem:
-            return Response({'message': 'Unable to retrieve valid item'}, status.HTTP_400_BAD_REQUEST)
+        serializer = CartItemInputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        item = serializer.validated_data
         try:
-            cart_item = Cart.objects.create(user = self.request.user, menuitem = menuitem, quantity = quantity, unit_price = unit_price, price = price)
-            
-        except:
-            cart_item = Cart.objects.get(menuitem=request_item['id'])
-            cart_item.quantity += quantity
-            
-        cart_item.save()
+            add_to_cart(request.user, {item['menuitem']: item['quantity']})
+        except CartItemNotFound:
+            return Response({'message': 'Unable to retrieve valid item'}, status.HTTP_400_BAD_REQUEST)
+        except CartLimitExceeded:
+            return Response({'message': 'Cart quantity or price too large'}, status.HTTP_400_BAD_REQUEST)
         return Response({'message':'Successfully added to cart'}, status.HTTP_200_OK)
     
     def delete(self, request, *args, **kwargs):
@@ -175,44 +287,131 @@ class CartView(generics.ListCreateAPIView, generics.DestroyAPIView):
         except:
             return Response({'message': 'Unable to delete cart'}, status.HTTP_400_BAD_REQUEST)
         
-class OrderView(generics.ListCreateAPIView):
+class CartBatchView(generics.GenericAPIView):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    serializer_class = CartItemInputSerializer
+    permission_classes = [IsAuthenticated]
+    max_items = 100
+
+    def post(self, request, *args, **kwargs):
+        data = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(data, list) or not 0 < len(data) <= self.max_items:
+            return Response({'message': 'Expected a list of 1 to %d items' % self.max_items}, status.HTTP_400_BAD_REQUEST)
+        serializer = CartItemInputSerializer(data=data, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        items = {}
+        for item in serializer.validated_data:
+            items[item['menuitem']] = items.get(item['menuitem'], 0) + item['quantity']
+        try:
+            add_to_cart(request.user, items)
+        except CartItemNotFound:
+            return Response({'message': 'Unable to retrieve valid item'}, status.HTTP_400_BAD_REQUEST)
+        except CartLimitExceeded:
+            return Response({'message': 'Cart quantity or price too large'}, status.HTTP_400_BAD_REQUEST)
+        return Response({'message': 'Successfully added %d items to cart' % len(items)}, status.HTTP_200_OK)
+
+def order_items():
+    # An order's lines with their menu items, for OrderDetailSerializer.
+    return Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('menuitem__category').order_by('id'))
+
+class OrderView(PageConditionalMixin, generics.ListCreateAPIView):
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    throttle_scopes = {'POST': 'checkout'}
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    filter_backends = [OrderFilter]
+    pagination_class = OrderPagination
+    export_fields = ('id', 'user', 'delivery_crew', 'status', 'total', 'date')
+    export_chunk_size = 2000
 
     def get_queryset(self):
-        if self.request.user.groups.filter(name="Manager").exists():
-            return Order.objects.all()
-        elif self.request.user.groups.filter(name="Delivery Crew").exists():
-            return Order.objects.filter(delivery_crew = self.request.user)
+        if is_manager(self.request.user):
+            queryset = Order.objects.all()
+        elif is_delivery_crew(self.request.user):
+            queryset = Order.objects.filter(delivery_crew = self.request.user)
         else:
-            return Order.objects.filter(user = self.request.user)
+            queryset = Order.objects.filter(user = self.request.user)
+        return queryset
+
+    def with_items(self):
+        return self.request.method == 'GET' and bool(parse_bool(self.request.query_params, 'items'))
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return OrderDetailSerializer if self.with_items() else OrderListSerializer
+        return OrderSerializer
+
+    def get_etag_parts(self, request, page):
+        parts = super().get_etag_parts(request, page)
+        if not self.with_items():
+            return parts
+        # Nested menu items change with the catalogue, not the orders.
+        return parts + (get_catalogue_version(request),)
+
+    def serialize_page(self, page):
+        if self.with_items():
+            # One more query for the whole page's lines and menu items, once
+            # the page is known to be needed.
+            prefetch_related_objects(page, order_items())
+        return super().serialize_page(page)
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('export') == 'ndjson':
+            return self.export(request)
+        return super().list(request, *args, **kwargs)
+
+    def export(self, request):
+        # Streams every matching order from a server-side cursor instead of paging.
+        rows = (self.filter_queryset(self.get_queryset()).order_by('-date', '-id')
+                .values(*self.export_fields).iterator(chunk_size=self.export_chunk_size))
+        lines = (json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
         
     def create(self, request, *args, **kwargs):
-        throttle_classes = [AnonRateThrottle, UserRateThrottle]
-        cart = Cart.objects.filter(user = request.user)
-        cart_items = cart.values()
-
-        if not cart_items:
+        try:
+            order = checkout(request.user)
+        except CartLimitExceeded:
+            return Response({'message': 'Order total too large'}, status.HTTP_400_BAD_REQUEST)
+        if order is None:
             return Response({'message': 'Cart is empty'}, status.HTTP_400_BAD_REQUEST)
-        
-        order = Order.objects.create(user = request.user, status = False, total = sum(cart_item['price'] for cart_item in cart_items), date = str(date.today()))
+        return Response({'message': 'Successfully placed order'}, status.HTTP_201_CREATED)
 
-        for item in cart_items:
-            order_item = OrderItem.objects.create(order = order, menuitem = get_object_or_404(MenuItem, id=item['menuitem_id']), quantity = item.get('quantity'), unit_price = item.get('unit_price'), price = item.get('price'))
-            order_item.save()
+class OrderAssignView(APIView):
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    permission_classes = [IsAuthenticated, IsManager]
 
-        cart.delete()
-        return Response({'message': 'Successfully placed order'}, status.HTTP_201_CREATED)
+    def post(self, request, *args, **kwargs):
+        limit = request.data.get('limit') if isinstance(request.data, dict) else None
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except (TypeError, ValueError):
+                return Response({'message': 'limit must be a whole number'}, status.HTTP_400_BAD_REQUEST)
+        assigned = assign_orders(limit)
+        return Response({
+            'message': 'Assigned %d orders' % sum(assigned.values()),
+            'assigned': [{'delivery_crew': crew_id, 'orders': count} for crew_id, count in sorted(assigned.items())],
+        }, status.HTTP_200_OK)
 
-class OrderItemView(generics.ListAPIView, generics.RetrieveUpdateDestroyAPIView):
+class OrderItemView(generics.RetrieveUpdateDestroyAPIView):
     throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    queryset = Order.objects.all()
     serializer_class = OrderItemSerializer
 
+    def get_order(self):
+        # Fetched once per request and shared by IsOrderOwner and the
+        # handlers.
+        if not hasattr(self, '_order'):
+            self._order = get_object_or_404(self.get_queryset(), pk=self.kwargs['pk'])
+        return self._order
+
+    def get_object(self):
+        return self.get_order()
+
     def get_permissions(self):
-        order = Order.objects.get(pk=self.kwargs['pk'])
-        if self.request.user == order.user and self.request.method == 'GET':
-            permission_classes = [IsAuthenticated]
+        if self.request.method == 'GET':
+            permission_classes = [IsAuthenticated, IsOrderOwner | IsManager | IsAdminUser]
         elif self.request.method == 'PUT' or self.request.method == 'DELETE':
             permission_classes = [IsAuthenticated, IsManager | IsAdminUser]
         elif self.request.method == 'PATCH':
@@ -221,30 +420,68 @@ class OrderItemView(generics.ListAPIView, generics.RetrieveUpdateDestroyAPIView)
             permission_classes = [IsAuthenticated, IsManager | IsAdminUser]
         return[permission() for permission in permission_classes] 
 
-    def get_queryset(self):
-        user = self.request.user
-        if user.groups.filter(name='Manager').exists():
-            return OrderItem.objects.all()
-        selected_order = Order.objects.get(id=self.kwargs.get('pk'))
-        return OrderItem.objects.filter(order=selected_order)
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return OrderDetailSerializer
+        return OrderItemSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        order = self.get_order()
+        prefetch_related_objects([order], order_items())
+        return Response(self.get_serializer(order).data)
     
     def patch(self, request, *args, **kwargs):
-        order = Order.objects.get(pk=self.kwargs['pk'])
+        order = self.get_order()
         order.status = not order.status
         order.save()
+        publish_order(STATUS_CHANGED, order)
         return Response({'message':'Status of order #'+ str(order.id)+' changed to '+str(order.status)}, status.HTTP_200_OK)
     
     def put(self, request, *args, **kwargs):
-        order = get_object_or_404(Order, pk=self.kwargs['pk'])
+        order = self.get_order()
         OrderItemSerializer(data=request.data).is_valid()
         new_crew_id = request.data['delivery_crew']
         new_crew = get_object_or_404(User, pk=new_crew_id)
-        order.delivery_crew = new_crew
-        order.save()
+        with transaction.atomic():
+            previous_crew_id = order.delivery_crew_id
+            record_assignment(order.date, previous_crew_id, new_crew.pk)
+            order.delivery_crew = new_crew
+            order.save()
+            publish_order(CREW_ASSIGNED, order, previous_delivery_crew=previous_crew_id)
         return Response({'message': 'Updated Delivery Crew to ' + str(new_crew) + ' for order ' + str(order.id)})
     
     def destroy(self, request, *args, **kwargs):
-        order = get_object_or_404(Order, pk=self.kwargs.get('pk'))
+        order = self.get_order()
         order_id = order.id
-        order.delete()
+        with transaction.atomic():
+            forget_order(order)
+            order.delete()
         return Response({'message': "Deleted order " + str(order_id)})
+
+
+class DailySalesReportView(APIView):
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    def get(self, request, *args, **kwargs):
+        rows = daily_sales(filter_report_dates(DailySales.objects.all(), request.query_params))
+        return Response(DailySalesSerializer(rows, many=True).data)
+
+class TopMenuItemsReportView(APIView):
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    permission_classes = [IsAuthenticated, IsManager]
+    default_limit = 10
+    max_limit = 100
+
+    def get(self, request, *args, **kwargs):
+        limit = parse_int(request.query_params, 'limit', 1, self.max_limit) or self.default_limit
+        rows = top_menu_items(filter_report_dates(DailyMenuItemSales.objects.all(), request.query_params), limit)
+        return Response(TopMenuItemSerializer(rows, many=True).data)
+
+class CrewOrdersReportView(APIView):
+    throttle_classes = [AnonRateThrottle, UserRateThrottle]
+    permission_classes = [IsAuthenticated, IsManager]
+
+    def get(self, request, *args, **kwargs):
+        rows = crew_orders(filter_report_dates(DailyCrewOrders.objects.all(), request.query_params))
+        return Response(CrewOrdersSerializer(rows, many=True).data)